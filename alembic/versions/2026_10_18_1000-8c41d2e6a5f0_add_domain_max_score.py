@@ -0,0 +1,41 @@
+"""Add domain max score table
+
+Revision ID: 8c41d2e6a5f0
+Revises: 3f2a9c71d4b8
+Create Date: 2026-10-18 10:00:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c41d2e6a5f0'
+down_revision: Union[str, None] = '3f2a9c71d4b8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('domainmaxscore',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('domain', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('code', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('mandatory', sa.Boolean(), nullable=False),
+    sa.Column('lmax_cr1', sa.Integer(), nullable=False),
+    sa.Column('lmax_cr2', sa.Integer(), nullable=False),
+    sa.Column('lmax_cr3', sa.Integer(), nullable=False),
+    sa.Column('lmax_cr4', sa.Integer(), nullable=False),
+    sa.Column('lmax_cr5', sa.Integer(), nullable=False),
+    sa.Column('lmax_cr6', sa.Integer(), nullable=False),
+    sa.Column('lmax_cr7', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('domainmaxscore')
@@ -0,0 +1,26 @@
+"""Add is_admin to person
+
+Revision ID: c7d3e8f1a2b6
+Revises: b52e7a1d9c34
+Create Date: 2026-10-18 12:00:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7d3e8f1a2b6'
+down_revision: Union[str, None] = 'b52e7a1d9c34'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('person', sa.Column('is_admin', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('person', 'is_admin')
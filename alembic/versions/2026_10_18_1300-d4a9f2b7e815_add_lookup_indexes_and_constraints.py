@@ -0,0 +1,53 @@
+"""Add lookup indexes and reference data unique constraints
+
+Revision ID: d4a9f2b7e815
+Revises: c7d3e8f1a2b6
+Create Date: 2026-10-18 13:00:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4a9f2b7e815'
+down_revision: Union[str, None] = 'c7d3e8f1a2b6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Reference table -> (unique constraint, its columns)
+REFERENCE_KEYS = {
+    'domain_w': ('uq_domain_w_building_type_zone_domain', ['building_type', 'zone', 'domain']),
+    'impact_w': ('uq_impact_w_building_type_zone', ['building_type', 'zone']),
+    'levels': ('uq_levels_code_level', ['code', 'level']),
+    'services': ('uq_services_domain_code', ['domain', 'code']),
+}
+
+
+def upgrade() -> None:
+    for table, (name, columns) in REFERENCE_KEYS.items():
+        # Concurrent loads by the old startup code could insert the CSV files twice; keep the first copy
+        keys = ', '.join(columns)
+        op.execute(f'DELETE FROM {table} WHERE id NOT IN (SELECT min(id) FROM {table} GROUP BY {keys})')
+        op.create_unique_constraint(name, table, columns)
+    op.create_index(op.f('ix_levels_domain'), 'levels', ['domain'], unique=False)
+
+    # Keyset pages compare (total_sri, id); a NULL score would drop the building from them
+    op.execute('UPDATE building SET total_sri = 0 WHERE total_sri IS NULL')
+    op.alter_column('building', 'total_sri', existing_type=sa.Float(), nullable=False, server_default=sa.text('0'))
+    op.create_index('ix_building_owner_id_id', 'building', ['owner_id', 'id'], unique=False)
+    op.create_index('ix_building_owner_id_building_name', 'building', ['owner_id', 'building_name'], unique=False)
+    op.create_index('ix_building_owner_id_total_sri', 'building', ['owner_id', 'total_sri', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_building_owner_id_total_sri', table_name='building')
+    op.drop_index('ix_building_owner_id_building_name', table_name='building')
+    op.drop_index('ix_building_owner_id_id', table_name='building')
+    op.alter_column('building', 'total_sri', existing_type=sa.Float(), nullable=True, server_default=None)
+    op.drop_index(op.f('ix_levels_domain'), table_name='levels')
+    for table, (name, columns) in REFERENCE_KEYS.items():
+        op.drop_constraint(name, table, type_='unique')
@@ -0,0 +1,95 @@
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import case, func, literal_column
+from sqlmodel import select
+
+from catalog import ScoringCatalog
+from models import Building
+from scoring import key_functionalities
+
+
+# Building columns /analytics/sri can group by
+ANALYTICS_GROUPS = ("zone", "building_type", "energy_class", "region", "year")
+
+# total_sri histogram buckets: [0, 10), [10, 20), ... [90, 100]
+SRI_BUCKET_WIDTH = 10
+SRI_BUCKETS = 100 // SRI_BUCKET_WIDTH
+
+
+# One number of a building's stored SRI result, read in SQL (NULL when the building lacks it)
+def sri_score(group: str, key: str):
+    return Building.sri_scores[(group, key)].as_float()
+
+
+# Bucket number of total_sri, spelled as a CASE so it rounds the same on every database. The
+# numbers are inlined: with bound parameters Postgres can't match the GROUP BY to the SELECT.
+def sri_bucket():
+    def number(value):
+        return literal_column(str(value))
+    return case(*[(Building.total_sri < number((bucket + 1) * SRI_BUCKET_WIDTH), number(bucket))
+                  for bucket in range(SRI_BUCKETS - 1)], else_=number(SRI_BUCKETS - 1))
+
+
+class SRIAnalytics:
+    """
+    Portfolio statistics of the scored buildings (those whose sri_scores
+    hold a total_sri), computed by the database with two GROUP BY queries:
+    count, mean, min and max of total_sri with the average of every domain
+    score and SRf, and a histogram of total_sri. Averages of a domain only
+    count the buildings that have it and, like every SRI value, are rounded
+    to two decimals. Without group_by the whole portfolio is one group.
+    """
+
+    def __init__(self, catalog: ScoringCatalog, group_by: Optional[str] = None, owner_id: Optional[int] = None):
+        self.domains: List[str] = list(catalog.levels_by_domain)
+        self.functionalities: List[str] = list(key_functionalities)
+        self.group_by = group_by
+        self.group_columns = [getattr(Building, group_by)] if group_by else []
+        self.filters = [Building.sri_scores["total_sri"].as_float().is_not(None)]
+        if owner_id is not None:
+            self.filters.append(Building.owner_id == owner_id)
+
+    def summary_statement(self):
+        return (select(*self.group_columns, func.count(), func.avg(Building.total_sri), func.min(Building.total_sri),
+                       func.max(Building.total_sri),
+                       *[func.avg(sri_score("sr_domains", domain)) for domain in self.domains],
+                       *[func.avg(sri_score("srf_scores", functionality)) for functionality in self.functionalities])
+                .where(*self.filters).group_by(*self.group_columns).order_by(*self.group_columns))
+
+    def histogram_statement(self):
+        bucket = sri_bucket()
+        return select(*self.group_columns, bucket, func.count()).where(*self.filters).group_by(*self.group_columns, bucket)
+
+    def report(self, summary_rows, histogram_rows) -> Dict[str, Any]:
+        offset = len(self.group_columns)
+        histograms = {}
+        for row in histogram_rows:
+            key = row[0] if offset else None
+            histograms.setdefault(key, [0] * SRI_BUCKETS)[row[offset]] = row[offset + 1]
+
+        groups = []
+        for row in summary_rows:
+            key = row[0] if offset else None
+            count, mean, minimum, maximum = row[offset:offset + 4]
+            if not count:
+                continue
+            domain_averages = row[offset + 4:offset + 4 + len(self.domains)]
+            srf_averages = row[offset + 4 + len(self.domains):]
+            groups.append({
+                "key": key,
+                "buildings": count,
+                "total_sri": {
+                    "mean": round(mean, 2),
+                    "min": minimum,
+                    "max": maximum,
+                    "histogram": [{"from": bucket * SRI_BUCKET_WIDTH, "to": (bucket + 1) * SRI_BUCKET_WIDTH,
+                                   "buildings": buildings}
+                                  for bucket, buildings in enumerate(histograms.get(key, [0] * SRI_BUCKETS))],
+                },
+                "sr_domains": {domain: round(average, 2) for domain, average in zip(self.domains, domain_averages)
+                               if average is not None},
+                "srf_scores": {functionality: round(average, 2)
+                               for functionality, average in zip(self.functionalities, srf_averages)
+                               if average is not None},
+            })
+        return {"group_by": self.group_by, "groups": groups}
@@ -0,0 +1,178 @@
+"""
+Shared setup of the benchmark suite.
+
+The app runs against a throwaway SQLite database unless SRI_DATABASE_URL
+points somewhere else (e.g. a local Postgres). Portfolios are synthetic
+buildings drawn from the reference data in Classes_CSV; their sizes come
+from SRI_BENCH_SIZES (default 1, 100 and 10000).
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# The reference CSV paths are relative to the repository root
+os.chdir(ROOT)
+os.environ.setdefault("SRI_DATABASE_URL", f"sqlite:///{tempfile.mkdtemp(prefix='sri-bench-')}/bench.db")
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event, insert
+
+import main
+from catalog import get_catalog
+from models import Building, async_engine, engine, get_session
+
+
+SIZES = [int(size) for size in os.getenv("SRI_BENCH_SIZES", "1,100,10000").split(",")]
+
+# Requests measured with tracemalloc per benchmark; tracing is slow, so only a sample
+ALLOCATION_SAMPLE = 200
+
+
+# Counts the statements sent to the database by both the sync and the async engine
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        for target in (engine, async_engine.sync_engine):
+            event.listen(target, "before_cursor_execute", self._count)
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+# A reproducible portfolio of SRI inputs built from the reference data
+def make_portfolio(size, seed=13):
+    catalog = get_catalog()
+    rng = random.Random(seed)
+    pairs = sorted({(building_type, zone) for building_type, zone, _ in catalog.domain_weights})
+    portfolio = []
+    for _ in range(size):
+        building_type, zone = rng.choice(pairs)
+        available = [domain for domain in catalog.levels_by_domain
+                     if (building_type, zone, domain) in catalog.domain_weights]
+        domains = rng.sample(available, rng.randint(1, len(available)))
+        lev = {}
+        for domain in domains:
+            for code in dict.fromkeys(entry.code for entry in catalog.levels_by_domain[domain]):
+                if rng.random() < 0.2:
+                    continue  # service not present in the building
+                top = catalog.max_level[code]
+                level = rng.randint(0, top)
+                if rng.random() < 0.2 and level < top:
+                    share = rng.choice((25, 50, 75))
+                    lev[code] = {level: share, level + 1: 100 - share}
+                else:
+                    lev[code] = {level: 100}
+        portfolio.append(main.SRIInput(building_type=building_type, zone=zone, dom=domains, lev=lev))
+    return portfolio
+
+
+# Insert one building per input, already scored, and return their ids
+def insert_buildings(portfolio):
+    rows = []
+    for i, sri_input in enumerate(portfolio):
+        sri_result = main.compute_sri(sri_input)
+        rows.append(dict(
+            building_name=f"bench-{i}", building_type=sri_input.building_type, building_usage="Office",
+            building_state="Existing", energy_class="B", zone=sri_input.zone, country="GR", city="Athens",
+            region="Attica", street="Benchmark", zip="10000", year="2000", domains=sri_input.dom,
+            sri_scores=sri_result, total_sri=sri_result["total_sri"], levels=sri_input.lev,
+        ))
+    with get_session() as session:
+        ids = session.execute(insert(Building).returning(Building.id), rows).scalars().all()
+        session.commit()
+    return ids
+
+
+def percentile_ms(latencies, q):
+    return round(float(np.percentile(latencies, q)) * 1000, 3)
+
+
+def record_profile(benchmark, call, items, query_counter, setup=None):
+    """
+    Run call once per item outside the timed rounds and attach the per-request
+    latency percentiles, database statements per request and memory allocated
+    per request to the benchmark's extra_info.
+    """
+    if setup:
+        setup()
+    latencies = []
+    queries_before = query_counter.count
+    for item in items:
+        started = time.perf_counter()
+        call(item)
+        latencies.append(time.perf_counter() - started)
+    queries = query_counter.count - queries_before
+
+    if setup:
+        setup()
+    peaks = []
+    tracemalloc.start()
+    try:
+        for item in items[:ALLOCATION_SAMPLE]:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            call(item)
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+
+    benchmark.extra_info.update(
+        requests=len(items),
+        p50_ms=percentile_ms(latencies, 50),
+        p95_ms=percentile_ms(latencies, 95),
+        p99_ms=percentile_ms(latencies, 99),
+        queries_per_request=round(queries / len(items), 3),
+        alloc_peak_kib_per_request=round(float(np.mean(peaks)) / 1024, 1),
+    )
+
+
+# Run the whole portfolio as one benchmark round; fewer rounds for the big portfolios
+def run_portfolio(benchmark, call, items, setup=None):
+    def run():
+        for item in items:
+            call(item)
+    rounds = max(1, min(10, 1000 // len(items)))
+    benchmark.pedantic(run, setup=setup, rounds=rounds, warmup_rounds=0)
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="session")
+def query_counter(client):
+    return QueryCounter()
+
+
+@pytest.fixture(scope="session")
+def portfolios(client):
+    cache = {}
+
+    def portfolio(size):
+        if size not in cache:
+            cache[size] = make_portfolio(size)
+        return cache[size]
+    return portfolio
+
+
+@pytest.fixture(scope="session")
+def buildings(portfolios):
+    cache = {}
+
+    # (building id, SRI input) pairs of a scored portfolio stored in the database
+    def stored(size):
+        if size not in cache:
+            portfolio = portfolios(size)
+            cache[size] = list(zip(insert_buildings(portfolio), portfolio))
+        return cache[size]
+    return stored
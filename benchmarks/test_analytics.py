@@ -0,0 +1,38 @@
+"""Portfolio analytics against the stored results, recomputed in Python: no timing."""
+import pytest
+from sqlmodel import select
+
+from analytics import SRIAnalytics
+from catalog import get_catalog
+from models import Building, get_session
+
+
+PORTFOLIO_SIZE = 100
+
+
+@pytest.mark.parametrize("group_by", [None, "zone"])
+def test_report_matches_stored_results(buildings, group_by):
+    buildings(PORTFOLIO_SIZE)
+    analytics = SRIAnalytics(get_catalog(), group_by)
+    with get_session() as session:
+        report = analytics.report(session.exec(analytics.summary_statement()).all(),
+                                  session.exec(analytics.histogram_statement()).all())
+        stored = session.exec(select(Building).where(*analytics.filters)).all()
+
+    groups = {}
+    for building in stored:
+        groups.setdefault(getattr(building, group_by) if group_by else None, []).append(building)
+    assert [group["key"] for group in report["groups"]] == sorted(groups, key=lambda key: (key is None, key))
+    for group in report["groups"]:
+        members = groups[group["key"]]
+        scores = [building.total_sri for building in members]
+        assert group["buildings"] == len(members)
+        assert group["total_sri"]["mean"] == round(sum(scores) / len(scores), 2)
+        assert sum(bucket["buildings"] for bucket in group["total_sri"]["histogram"]) == len(members)
+        for domain, average in group["sr_domains"].items():
+            values = [building.sri_scores["sr_domains"][domain] for building in members
+                      if domain in building.sri_scores["sr_domains"]]
+            assert average == round(sum(values) / len(values), 2)
+        for functionality, average in group["srf_scores"].items():
+            values = [building.sri_scores["srf_scores"][functionality] for building in members]
+            assert average == round(sum(values) / len(values), 2)
@@ -0,0 +1,35 @@
+"""The planning pool recovers from a worker that dies: no timing."""
+import asyncio
+import os
+
+import pytest
+
+from planning import PlanningPool, PlanningWorkerCrashed
+
+
+# Jobs run in the workers, so they live at module level where pickle can find them
+def crash(should_stop):
+    os._exit(1)
+
+
+def answer(value, should_stop):
+    return value
+
+
+def test_pool_recovers_after_a_worker_dies(client):
+    pool = PlanningPool(max_workers=1, max_pending=4)
+
+    async def jobs():
+        with pytest.raises(PlanningWorkerCrashed):
+            await pool.run(crash, timeout=30)
+        return await pool.run(answer, 42, timeout=30)
+
+    try:
+        assert asyncio.run(jobs()) == 42
+        stats = pool.stats()
+    finally:
+        pool.shutdown()
+    # Both attempts of the crashing job broke a pool; the next job got a new one
+    assert stats["restarts"] == 2
+    assert stats["pending"] == 0
+    assert stats["completed"] == 1
@@ -0,0 +1,52 @@
+"""The hot lookups are served by an index: EXPLAIN plan checks, no timing."""
+import pytest
+from sqlmodel import select, text
+
+from models import Building, Domain_W, Impact_W, Levels, Services, engine, get_session
+from pagination import keyset_page
+
+
+# (lookup, statement, index expected in its plan); unique constraints are matched by table
+# on SQLite, whose indexes for them are named sqlite_autoindex_<table>_<n>
+LOOKUPS = [
+    ("levels by code", select(Levels).where(Levels.code == "H-1a"), "uq_levels_code_level"),
+    ("levels by code and level", select(Levels).where(Levels.code == "H-1a", Levels.level == 2),
+     "uq_levels_code_level"),
+    ("levels by domain", select(Levels).where(Levels.domain == "Heating"), "ix_levels_domain"),
+    ("services by domain", select(Services).where(Services.domain == "Heating"), "uq_services_domain_code"),
+    ("domain weights", select(Domain_W).where(
+        Domain_W.building_type == "Residential", Domain_W.zone == "North Europe", Domain_W.domain == "Heating"),
+     "uq_domain_w_building_type_zone_domain"),
+    ("impact weights", select(Impact_W).where(
+        Impact_W.building_type == "Residential", Impact_W.zone == "North Europe"),
+     "uq_impact_w_building_type_zone"),
+    ("current building", select(Building).where(Building.building_name == "Home", Building.owner_id == 1),
+     "ix_building_owner_id_building_name"),
+    ("my buildings page", keyset_page(select(Building.id).where(Building.owner_id == 1),
+                                      Building.id, Building.id, False, (100, 100)).limit(101),
+     "ix_building_owner_id_id"),
+    ("my buildings by score", keyset_page(select(Building.id, Building.total_sri).where(Building.owner_id == 1),
+                                          Building.total_sri, Building.id, True, (50.0, 100)).limit(101),
+     "ix_building_owner_id_total_sri"),
+]
+
+
+def query_plan(session, statement) -> str:
+    sql = str(statement.compile(engine, compile_kwargs={"literal_binds": True}))
+    if engine.dialect.name == "sqlite":
+        return "\n".join(row[-1] for row in session.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+    # The benchmark tables are small enough for a sequential scan to win; ask whether an index can serve
+    session.execute(text("SET LOCAL enable_seqscan = off"))
+    return "\n".join(row[0] for row in session.execute(text(f"EXPLAIN {sql}")))
+
+
+@pytest.mark.parametrize("statement, index", [lookup[1:] for lookup in LOOKUPS], ids=[lookup[0] for lookup in LOOKUPS])
+def test_lookup_uses_index(client, statement, index):
+    with get_session() as session:
+        plan = query_plan(session, statement)
+        session.rollback()
+    table = statement.get_final_froms()[0].name
+    expected = [index]
+    if engine.dialect.name == "sqlite" and index.startswith("uq_"):
+        expected.append(f"sqlite_autoindex_{table}_")
+    assert any(name in plan for name in expected), plan
@@ -0,0 +1,35 @@
+"""The HTTP routes end to end, through the app and the database."""
+import pytest
+
+import main
+from conftest import SIZES, record_profile, run_portfolio
+
+
+@pytest.mark.parametrize("cached", [False, True], ids=["cold", "warm"])
+@pytest.mark.parametrize("size", SIZES)
+def test_calculate_sri_route(benchmark, client, buildings, query_counter, size, cached):
+    stored = buildings(size)
+
+    def call(item):
+        building_id, sri_input = item
+        response = client.post(f"/calculate-sri/{building_id}/", json=sri_input.model_dump())
+        assert response.status_code == 200, response.text
+
+    # Cold runs score every building; warm runs are answered from the result cache
+    setup = None if cached else main.result_cache.clear
+    record_profile(benchmark, call, stored, query_counter, setup=setup)
+    run_portfolio(benchmark, call, stored, setup=setup)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_upgrade_sri_route(benchmark, client, buildings, query_counter, size):
+    items = [(building_id, min(100.0, main.compute_sri(sri_input)["total_sri"] + 10))
+             for building_id, sri_input in buildings(size)]
+
+    def call(item):
+        building_id, target_sri = item
+        response = client.post(f"/upgrade_sri/{building_id}/", json={"target_sri": target_sri})
+        assert response.status_code in (200, 400), response.text
+
+    record_profile(benchmark, call, items, query_counter)
+    run_portfolio(benchmark, call, items)
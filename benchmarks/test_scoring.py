@@ -0,0 +1,29 @@
+"""Scoring functions called directly, without HTTP or the database."""
+import pytest
+
+import main
+from conftest import SIZES, record_profile, run_portfolio
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_calculate_scores(benchmark, portfolios, query_counter, size):
+    portfolio = portfolios(size)
+    record_profile(benchmark, main.calculate_scores, portfolio, query_counter)
+    run_portfolio(benchmark, main.calculate_scores, portfolio)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_calculate_weighted_sums(benchmark, portfolios, query_counter, size):
+    items = [(sri_input, main.calculate_scores(sri_input)["domain_impact_scores"]) for sri_input in portfolios(size)]
+
+    def call(item):
+        return main.calculate_weighted_sums(*item)
+    record_profile(benchmark, call, items, query_counter)
+    run_portfolio(benchmark, call, items)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_compute_sri(benchmark, portfolios, query_counter, size):
+    portfolio = portfolios(size)
+    record_profile(benchmark, main.compute_sri, portfolio, query_counter)
+    run_portfolio(benchmark, main.compute_sri, portfolio)
@@ -0,0 +1,196 @@
+"""
+The vectorized ScoringEngine against the original per-service loop: no timing.
+
+reference_sri is the calculation the engine replaced, kept as it was (loop
+order, float summation order and rounding included) but reading the
+reference tables from memory instead of one query per service. The engine
+relies on reproducing that summation order, so its results must match
+exactly, not approximately.
+"""
+import random
+
+import pytest
+from sqlmodel import select
+
+import main
+from catalog import get_catalog
+from models import Domain_W, Levels, get_session
+from scoring import get_scoring_engine
+
+
+PORTFOLIO_SIZE = 500
+
+IMPACT_CRITERIA = [
+    "Energy efficiency", "Energy, flexibility and storage", "Comfort", "Convenience",
+    "Health, wellbeing and accessibility", "Maintenance and fault prediction", "Information to occupants",
+]
+SCORE_FIELDS = dict(zip(IMPACT_CRITERIA, (f"score_cr{i}" for i in range(1, 8))))
+WEIGHT_FIELDS = dict(zip(IMPACT_CRITERIA, (f"dw_cr{i}" for i in range(1, 8))))
+MANDATORY_SERVICES = {
+    'Heating': ['H-3', 'H-4'],
+    'Domestic hot water': ['DHW-3'],
+    'Cooling': ['C-1f', 'C-2a', 'C-3', 'C-4'],
+    'Ventilation': ['V-1a', 'V-6'],
+    'Lighting': ['L-1a', 'L-2'],
+    'Dynamic building envelope': ['DE-2'],
+    'Electricity': ['E-12'],
+    'Monitoring and control': ['MC-3', 'MC-4', 'MC-9', 'MC-13', 'MC-25', 'MC-28', 'MC-29', 'MC-30'],
+}
+IMPACT_WEIGHTS = {
+    "Energy efficiency": 0.5, "Energy, flexibility and storage": 1, "Comfort": 0.25, "Convenience": 0.25,
+    "Health, wellbeing and accessibility": 0.25, "Maintenance and fault prediction": 0.5,
+    "Information to occupants": 0.25,
+}
+KEY_FUNCTIONALITIES = {
+    "Energy Performance and Operation": ["Energy efficiency", "Maintenance and fault prediction"],
+    "Response to User Needs": ["Comfort", "Convenience", "Information to occupants",
+                               "Health, wellbeing and accessibility"],
+    "Energy Flexibility": ["Energy, flexibility and storage"],
+}
+
+
+@pytest.fixture(scope="module")
+def reference_tables(client):
+    with get_session() as session:
+        levels = session.exec(select(Levels).order_by(Levels.id)).all()
+        domain_weights = session.exec(select(Domain_W).order_by(Domain_W.id)).all()
+    return levels, domain_weights
+
+
+def reference_sri(levels, domain_weights, building_type, zone, domains, lev):
+    domain_impact_scores, domain_max_scores, smart_readiness_scores = {}, {}, {}
+    for domain in domains:
+        max_scores = {ic: 0 for ic in IMPACT_CRITERIA}
+        domain_levels = [level for level in levels if level.domain == domain]
+        max_level_for_service = {}
+        for level in domain_levels:
+            if level.code in lev:
+                if level.code not in max_level_for_service or max_level_for_service[level.code] < level.level:
+                    max_level_for_service[level.code] = level.level
+        for mandatory_service in MANDATORY_SERVICES.get(domain, []):
+            for level in levels:
+                if level.code == mandatory_service:
+                    if mandatory_service not in max_level_for_service or max_level_for_service[mandatory_service] < level.level:
+                        max_level_for_service[mandatory_service] = level.level
+        for ic in IMPACT_CRITERIA:
+            for service_code, max_level in max_level_for_service.items():
+                instance = next((level for level in levels if level.code == service_code and level.level == max_level), None)
+                if instance:
+                    max_scores[ic] += getattr(instance, SCORE_FIELDS[ic])
+            domain_max_scores[f"{domain}-{ic}"] = max_scores[ic]
+        for ic in IMPACT_CRITERIA:
+            total_score = 0
+            for level in domain_levels:
+                level_input = lev.get(level.code)
+                if level_input:
+                    level_scores = [getattr(level, SCORE_FIELDS[ic]) * (percentage / 100)
+                                    for user_level, percentage in level_input.items() if level.level == user_level]
+                    total_score += sum(level_scores)
+            domain_impact_scores[f"{domain}-{ic}"] = total_score
+    for key, l_score in domain_impact_scores.items():
+        lmax_score = domain_max_scores[key]
+        smart_readiness_scores[key] = round((l_score / lmax_score) * 100 if lmax_score != 0 else 0, 2)
+
+    def weighted_sums(scores):
+        sums = {ic: 0 for ic in IMPACT_CRITERIA}
+        for key, score in scores.items():
+            domain, ic = key.split("-")
+            weights = next(row for row in domain_weights
+                           if row.building_type == building_type and row.zone == zone and row.domain == domain)
+            sums[ic] += getattr(weights, WEIGHT_FIELDS[ic], 1) * score
+        return sums
+
+    sums, max_sums = weighted_sums(domain_impact_scores), weighted_sums(domain_max_scores)
+    sr_impact_criteria = {ic: round((sums[ic] / max_sums[ic]) * 100 if max_sums[ic] != 0 else 0, 2) for ic in sums}
+    srf_scores = {}
+    for functionality, criteria in KEY_FUNCTIONALITIES.items():
+        srf_score = 0
+        for ic in criteria:
+            srf_score += IMPACT_WEIGHTS[ic] * sr_impact_criteria[ic]
+        srf_scores[functionality] = round(srf_score, 2)
+    total_sri = 0
+    for score in srf_scores.values():
+        total_sri += score * (1 / 3)
+
+    def domain_sums(scores):
+        totals = {}
+        for key, score in scores.items():
+            domain, ic = key.split("-")
+            totals[domain] = totals.get(domain, 0) + IMPACT_WEIGHTS[ic] * score
+        return totals
+
+    domain_totals, domain_max_totals = domain_sums(domain_impact_scores), domain_sums(domain_max_scores)
+    sr_domains = {domain: round((total / domain_max_totals[domain]) * 100 if domain_max_totals.get(domain, 0) != 0 else 0, 2)
+                  for domain, total in domain_totals.items()}
+    return {"smart_readiness_scores": smart_readiness_scores, "sr_impact_criteria": sr_impact_criteria,
+            "sr_domains": sr_domains, "srf_scores": srf_scores, "total_sri": round(total_sri, 2)}
+
+
+# Random inputs in the shapes the app gets: split and partial percentages, levels a service
+# does not have, empty services, repeated domains and services of domains left out
+def random_inputs(size, seed=2):
+    catalog = get_catalog()
+    rng = random.Random(seed)
+    pairs = sorted({(building_type, zone) for building_type, zone, _ in catalog.domain_weights})
+    codes = list(catalog.levels_by_code)
+    inputs = []
+    for _ in range(size):
+        building_type, zone = rng.choice(pairs)
+        available = [domain for domain in catalog.levels_by_domain
+                     if (building_type, zone, domain) in catalog.domain_weights]
+        domains = rng.sample(available, rng.randint(1, len(available)))
+        if rng.random() < 0.1:
+            domains.append(domains[0])
+        lev = {}
+        for code in rng.sample(codes, rng.randint(1, len(codes))):
+            draw = rng.random()
+            if draw < 0.6:
+                lev[code] = {rng.randint(0, 4): 100}
+            elif draw < 0.85:
+                low, high = rng.sample(range(5), 2)
+                share = rng.randint(0, 100)
+                lev[code] = {low: share, high: 100 - share}
+            elif draw < 0.95:
+                lev[code] = {rng.randint(0, 6): rng.randint(0, 100)}
+            else:
+                lev[code] = {}
+        inputs.append(main.SRIInput(building_type=building_type, zone=zone, dom=domains, lev=lev))
+    return inputs
+
+
+def test_engine_matches_reference(reference_tables):
+    levels, domain_weights = reference_tables
+    mismatches = []
+    for sri_input in random_inputs(PORTFOLIO_SIZE):
+        expected = reference_sri(levels, domain_weights, sri_input.building_type, sri_input.zone,
+                                 sri_input.dom, sri_input.lev)
+        if main.compute_sri(sri_input) != expected:
+            mismatches.append(sri_input)
+    assert not mismatches, f"{len(mismatches)} of {PORTFOLIO_SIZE} results differ, e.g. {mismatches[0]!r}"
+
+
+# level_change_total against a full rescoring of the changed input; the change is drawn from
+# every service, so it is also tried on services that aren't configured or have nothing to move
+def test_level_change_matches_reference(reference_tables):
+    levels, domain_weights = reference_tables
+    scoring_engine = get_scoring_engine()
+    rng = random.Random(3)
+    mismatches, rejected = [], 0
+    for sri_input in random_inputs(PORTFOLIO_SIZE, seed=3):
+        breakdown = scoring_engine.breakdown(sri_input.building_type, sri_input.zone, sri_input.dom, sri_input.lev)
+        code = rng.choice(list(sri_input.lev) if rng.random() < 0.8 else scoring_engine.codes)
+        old_level, new_level = rng.randrange(scoring_engine.n_levels), rng.randrange(scoring_engine.n_levels)
+        service_levels = dict(sri_input.lev.get(code, {}))
+        if not service_levels.get(old_level):
+            with pytest.raises(ValueError):
+                scoring_engine.level_change_total(breakdown, code, old_level, new_level)
+            rejected += 1
+            continue
+        moved = service_levels.pop(old_level)
+        service_levels[new_level] = service_levels.get(new_level, 0) + moved
+        expected = reference_sri(levels, domain_weights, sri_input.building_type, sri_input.zone,
+                                 sri_input.dom, {**sri_input.lev, code: service_levels})
+        if scoring_engine.level_change_total(breakdown, code, old_level, new_level) != expected["total_sri"]:
+            mismatches.append((sri_input, code, old_level, new_level))
+    assert rejected < PORTFOLIO_SIZE
+    assert not mismatches, f"{len(mismatches)} of {PORTFOLIO_SIZE} level changes differ, e.g. {mismatches[0]!r}"
@@ -0,0 +1,43 @@
+"""Upgrade plans for high targets, where the search can run out of budget: no timing."""
+import pytest
+
+from catalog import get_catalog
+from planning import plan_upgrade
+from scoring import get_scoring_engine
+from upgrade import UpgradePlanner
+
+
+BUILDING_TYPE, ZONE = "Residential", "North Europe"
+
+
+# Every domain of the building type and zone, every service at level 0
+@pytest.fixture(scope="module")
+def bare_building(client):
+    catalog = get_catalog()
+    domains = [domain for domain in catalog.levels_by_domain if (BUILDING_TYPE, ZONE, domain) in catalog.domain_weights]
+    levels = {code: {0: 100} for domain in domains
+              for code in dict.fromkeys(entry.code for entry in catalog.levels_by_domain[domain])}
+    return domains, levels
+
+
+@pytest.mark.parametrize("target_sri", [60, 90, 99, 100])
+def test_reachable_target_gets_a_plan(bare_building, target_sri):
+    domains, levels = bare_building
+    result = plan_upgrade(BUILDING_TYPE, ZONE, domains, levels, target_sri)
+    assert "message" not in result
+    assert result["New_Score"] >= target_sri
+    upgraded = get_scoring_engine().evaluate(BUILDING_TYPE, ZONE, domains, {**levels, **result["Upgrades"]})
+    assert upgraded["total_sri"] == result["New_Score"]
+
+
+def test_unreachable_target(bare_building):
+    domains, levels = bare_building
+    assert plan_upgrade(BUILDING_TYPE, ZONE, domains, levels, 100.5) == {"message": "No valid upgrades found"}
+
+
+def test_exhausted_budget_keeps_a_plan(bare_building):
+    domains, levels = bare_building
+    planner = UpgradePlanner(get_scoring_engine(), BUILDING_TYPE, ZONE, domains, levels, max_evaluations=300)
+    plan = planner.plan(95)
+    assert plan is not None and not plan.complete
+    assert plan.achieved_sri >= 95
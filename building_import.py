@@ -0,0 +1,215 @@
+"""
+Bulk import of buildings from CSV or NDJSON, with their service levels.
+
+Used by POST /buildings/import and from the command line:
+
+    python building_import.py buildings.csv --owner alice --score
+
+Rows have the /add_building/ fields plus optional domains and levels, in
+the layout of /buildings/export: domains joined with ";", and levels
+either as a "levels" JSON object or as "levels.<code>.<level>" percentage
+columns. Other columns (id, owner_id, scores) are ignored.
+"""
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import argparse
+import csv
+import io
+import json
+import logging
+import sys
+
+import orjson
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlmodel import select
+
+from models import Building, get_session, person
+from scoring import MissingWeightsError, get_scoring_engine
+
+
+IMPORT_FORMATS = ("csv", "ndjson")
+IMPORT_CHUNK_SIZE = 1000
+
+
+class BuildingImportRow(BaseModel):
+    building_name: str
+    building_type: str
+    building_usage: str
+    building_state: str
+    energy_class: str
+    zone: str
+    country: str
+    city: str
+    region: str
+    street: str
+    zip: str
+    year: str
+    domains: List[str] = []
+    levels: Dict[str, Dict[int, int]] = {}
+
+
+# The format of an uploaded file, from its name or content type
+def import_format_for(filename: Optional[str], content_type: Optional[str]) -> Optional[str]:
+    name = (filename or "").lower()
+    if name.endswith(".csv") or content_type == "text/csv":
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl")) or content_type in ("application/x-ndjson", "application/jsonl"):
+        return "ndjson"
+    return None
+
+
+# Exported / hand-written row -> the shape BuildingImportRow validates; ValueError if unreadable
+def normalize_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    normalized = {}
+    levels = record.get("levels") or {}
+    if isinstance(levels, str):
+        try:
+            levels = json.loads(levels)
+        except ValueError:
+            raise ValueError("levels: Invalid JSON")
+    for key, value in record.items():
+        if key is None:
+            raise ValueError("More fields than the header has columns")
+        if key.startswith("levels."):
+            code, _, level = key[len("levels."):].rpartition(".")
+            if value not in (None, ""):
+                levels.setdefault(code, {})[level] = value
+        elif key != "levels" and value != "":
+            normalized[key] = value
+    domains = normalized.get("domains")
+    if isinstance(domains, str):
+        normalized["domains"] = [domain for domain in domains.split(";") if domain]
+    normalized["levels"] = levels
+    return normalized
+
+
+# (row number, record or the reason it could not be read) for every data row of the file
+def read_records(binary_file, import_format: str) -> Iterator[Tuple[int, Any]]:
+    if import_format == "csv":
+        text = io.TextIOWrapper(binary_file, encoding="utf-8-sig", newline="")
+        try:
+            for number, record in enumerate(csv.DictReader(text), start=1):
+                yield number, record
+        finally:
+            text.detach()
+        return
+
+    number = 0
+    for line in binary_file:
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            record = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            yield number, ValueError("Invalid JSON")
+            continue
+        yield number, record if isinstance(record, dict) else ValueError("Expected a JSON object")
+
+
+def validation_messages(error: ValidationError) -> List[str]:
+    return [f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}" for item in error.errors()]
+
+
+# Validate (and optionally score) one chunk: the rows to insert, their row numbers and the errors
+def prepare_chunk(records, owner_id: int, score: bool):
+    scoring_engine = get_scoring_engine() if score else None
+    rows, numbers, errors = [], [], []
+    for number, record in records:
+        if isinstance(record, Exception):
+            errors.append({"row": number, "errors": [str(record)]})
+            continue
+        try:
+            data = BuildingImportRow.model_validate(normalize_record(record))
+        except ValidationError as e:
+            errors.append({"row": number, "errors": validation_messages(e)})
+            continue
+        except ValueError as e:
+            errors.append({"row": number, "errors": [str(e)]})
+            continue
+
+        row = data.model_dump()
+        row["owner_id"] = owner_id
+        row["sri_scores"] = {}
+        row["total_sri"] = 0.0
+        if scoring_engine is not None and data.domains and data.levels:
+            try:
+                sri_result = scoring_engine.evaluate(data.building_type, data.zone, data.domains, data.levels)
+            except MissingWeightsError:
+                errors.append({"row": number, "errors": ["No weights found for the given zone and building type"]})
+                continue
+            row["sri_scores"] = sri_result
+            row["total_sri"] = sri_result["total_sri"]
+        rows.append(row)
+        numbers.append(number)
+    return rows, numbers, errors
+
+
+def import_buildings(binary_file, import_format: str, owner_id: int, score: bool = False,
+                     chunk_size: int = IMPORT_CHUNK_SIZE) -> Dict[str, Any]:
+    """
+    Import the buildings of an open binary file for owner_id, chunk_size rows
+    at a time: each chunk is validated, optionally scored, inserted with one
+    executemany INSERT ... RETURNING and committed, so a failed chunk leaves
+    the others in place. Returns the counts, the ids of the new buildings in
+    file order and one error entry per rejected row.
+    """
+    records = read_records(binary_file, import_format)
+    report = {"total": 0, "imported": 0, "failed": 0, "ids": [], "errors": []}
+    with get_session() as session:
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                break
+            report["total"] += len(chunk)
+            rows, numbers, errors = prepare_chunk(chunk, owner_id, score)
+            if rows:
+                try:
+                    ids = session.execute(
+                        insert(Building).returning(Building.id, sort_by_parameter_order=True), rows
+                    ).scalars().all()
+                    session.commit()
+                except SQLAlchemyError as e:
+                    session.rollback()
+                    logging.error(f"Database error: {str(e)}")
+                    errors.extend({"row": number, "errors": [f"Database error: {str(e)}"]} for number in numbers)
+                else:
+                    report["ids"].extend(ids)
+                    report["imported"] += len(ids)
+            errors.sort(key=lambda error: error["row"])
+            report["errors"].extend(errors)
+            report["failed"] += len(errors)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import buildings from a CSV or NDJSON file.")
+    parser.add_argument("path", help="CSV or NDJSON file, - for standard input")
+    parser.add_argument("--owner", required=True, help="username of the buildings' owner")
+    parser.add_argument("--format", choices=IMPORT_FORMATS, help="file format (default: from the file name)")
+    parser.add_argument("--score", action="store_true", help="also calculate the SRI of every building")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    import_format = args.format or import_format_for(args.path, None)
+    if import_format is None:
+        parser.error("cannot tell the file format from its name; pass --format")
+    with get_session() as session:
+        owner_id = session.exec(select(person.id).where(person.username == args.owner)).first()
+    if owner_id is None:
+        parser.error(f"unknown user: {args.owner}")
+
+    if args.path == "-":
+        report = import_buildings(sys.stdin.buffer, import_format, owner_id, args.score, args.chunk_size)
+    else:
+        with open(args.path, "rb") as binary_file:
+            report = import_buildings(binary_file, import_format, owner_id, args.score, args.chunk_size)
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple
+import hashlib
+import threading
+
+import orjson
+
+from sqlmodel import select
+from models import get_session, current_reference_data_version, Levels, Services, Domain_W, Impact_W
+
+
+# Column names of the seven impact criteria in the reference tables
+SCORE_FIELDS = ("score_cr1", "score_cr2", "score_cr3", "score_cr4", "score_cr5", "score_cr6", "score_cr7")
+DOMAIN_WEIGHT_FIELDS = ("dw_cr1", "dw_cr2", "dw_cr3", "dw_cr4", "dw_cr5", "dw_cr6", "dw_cr7")
+IMPACT_WEIGHT_FIELDS = ("imp_cr1", "imp_cr2", "imp_cr3", "imp_cr4", "imp_cr5", "imp_cr6", "imp_cr7")
+
+
+# One row of the levels table, with the seven criteria scores packed in a tuple
+@dataclass(frozen=True)
+class LevelEntry:
+    code: str
+    level: int
+    domain: str
+    mandatory: bool
+    level_desc: str
+    description: str
+    scores: Tuple[int, ...]
+
+
+# One row of the services table
+@dataclass(frozen=True)
+class ServiceEntry:
+    domain: str
+    code: str
+    service_group: str
+    service_desc: str
+
+
+@dataclass(frozen=True)
+class ScoringCatalog:
+    """
+    Immutable snapshot of the Levels, Services, Domain_W and Impact_W tables.
+
+    The rows keep the table (id) order so the scoring loops visit them in the
+    same order as the queries they replace.
+    """
+    levels: Tuple[LevelEntry, ...]
+    levels_by_key: Mapping[Tuple[str, int], LevelEntry]
+    levels_by_domain: Mapping[str, Tuple[LevelEntry, ...]]
+    levels_by_code: Mapping[str, Tuple[LevelEntry, ...]]
+    max_level: Mapping[str, int]
+    services: Tuple[ServiceEntry, ...]
+    services_by_domain: Mapping[str, Tuple[ServiceEntry, ...]]
+    domain_weights: Mapping[Tuple[str, str, str], Tuple[float, ...]]
+    impact_weights: Mapping[Tuple[str, str], Tuple[float, ...]]
+    version: Optional[str] = None  # ReferenceDataVersion the rows were loaded with
+
+    @classmethod
+    def from_rows(cls, levels: List[Levels], services: List[Services],
+                  domain_weights: List[Domain_W], impact_weights: List[Impact_W],
+                  version: Optional[str] = None) -> "ScoringCatalog":
+        level_entries = tuple(
+            LevelEntry(
+                code=row.code,
+                level=int(row.level),
+                domain=row.domain,
+                mandatory=bool(row.mandatory),
+                level_desc=row.level_desc,
+                description=row.description,
+                scores=tuple(int(getattr(row, field)) for field in SCORE_FIELDS),
+            )
+            for row in levels
+        )
+
+        levels_by_key: Dict[Tuple[str, int], LevelEntry] = {}
+        levels_by_domain: Dict[str, List[LevelEntry]] = {}
+        levels_by_code: Dict[str, List[LevelEntry]] = {}
+        max_level: Dict[str, int] = {}
+        for entry in level_entries:
+            # Keep the first row for a (code, level) pair, like query(...).first() did
+            levels_by_key.setdefault((entry.code, entry.level), entry)
+            levels_by_domain.setdefault(entry.domain, []).append(entry)
+            levels_by_code.setdefault(entry.code, []).append(entry)
+            if entry.code not in max_level or max_level[entry.code] < entry.level:
+                max_level[entry.code] = entry.level
+
+        service_entries = tuple(
+            ServiceEntry(domain=row.domain, code=row.code,
+                         service_group=row.service_group, service_desc=row.service_desc)
+            for row in services
+        )
+        services_by_domain: Dict[str, List[ServiceEntry]] = {}
+        for entry in service_entries:
+            services_by_domain.setdefault(entry.domain, []).append(entry)
+
+        domain_weight_map: Dict[Tuple[str, str, str], Tuple[float, ...]] = {}
+        for row in domain_weights:
+            domain_weight_map.setdefault(
+                (row.building_type, row.zone, row.domain),
+                tuple(float(getattr(row, field)) for field in DOMAIN_WEIGHT_FIELDS),
+            )
+
+        impact_weight_map: Dict[Tuple[str, str], Tuple[float, ...]] = {}
+        for row in impact_weights:
+            impact_weight_map.setdefault(
+                (row.building_type, row.zone),
+                tuple(float(getattr(row, field)) for field in IMPACT_WEIGHT_FIELDS),
+            )
+
+        return cls(
+            levels=level_entries,
+            levels_by_key=MappingProxyType(levels_by_key),
+            levels_by_domain=MappingProxyType({k: tuple(v) for k, v in levels_by_domain.items()}),
+            levels_by_code=MappingProxyType({k: tuple(v) for k, v in levels_by_code.items()}),
+            max_level=MappingProxyType(max_level),
+            services=service_entries,
+            services_by_domain=MappingProxyType({k: tuple(v) for k, v in services_by_domain.items()}),
+            domain_weights=MappingProxyType(domain_weight_map),
+            impact_weights=MappingProxyType(impact_weight_map),
+            version=version,
+        )
+
+    @classmethod
+    def from_session(cls, session) -> "ScoringCatalog":
+        return cls.from_rows(
+            session.exec(select(Levels).order_by(Levels.id)).all(),
+            session.exec(select(Services).order_by(Services.id)).all(),
+            session.exec(select(Domain_W).order_by(Domain_W.id)).all(),
+            session.exec(select(Impact_W).order_by(Impact_W.id)).all(),
+            version=current_reference_data_version(session),
+        )
+
+    def level(self, code: str, level: int) -> Optional[LevelEntry]:
+        return self.levels_by_key.get((code, level))
+
+    def next_level(self, code: str, current_level: int) -> Optional[int]:
+        entry = self.levels_by_key.get((code, current_level + 1))
+        return entry.level if entry else None
+
+    def domain_weight(self, building_type: str, zone: str, domain: str) -> Optional[Tuple[float, ...]]:
+        return self.domain_weights.get((building_type, zone, domain))
+
+    # Every domain with its services and their levels, as served by /catalog. Like
+    # /services and /levels, user defined services are left out and duplicate rows merged.
+    def as_payload(self) -> dict:
+        domains = {}
+        for domain, services in self.services_by_domain.items():
+            unique = {(entry.code, entry.service_desc): entry for entry in reversed(services)
+                      if not entry.service_desc.startswith("User defined smart ready service")}
+            domains[domain] = [
+                {
+                    "code": entry.code,
+                    "service_group": entry.service_group,
+                    "service_desc": entry.service_desc,
+                    "levels": self._level_payload(entry.code),
+                }
+                for _, entry in sorted(unique.items())
+            ]
+        return {"version": self.version, "domains": domains}
+
+    def _level_payload(self, code: str) -> List[dict]:
+        unique = {(entry.level, entry.level_desc, entry.description): entry
+                  for entry in reversed(self.levels_by_code.get(code, ()))}
+        levels = []
+        for _, entry in sorted(unique.items()):
+            level = {"level": entry.level, "level_desc": entry.level_desc, "description": entry.description,
+                     "mandatory": entry.mandatory}
+            level.update(zip(SCORE_FIELDS, entry.scores))
+            levels.append(level)
+        return levels
+
+
+# The /catalog response for one catalog, encoded once
+@dataclass(frozen=True)
+class CatalogDocument:
+    body: bytes
+    etag: str  # strong ETag, quoted
+
+
+def build_catalog_document(catalog: ScoringCatalog) -> CatalogDocument:
+    body = orjson.dumps(catalog.as_payload())
+    tag = catalog.version or hashlib.sha256(body).hexdigest()
+    return CatalogDocument(body=body, etag=f'"{tag}"')
+
+
+_catalog: Optional[ScoringCatalog] = None
+_catalog_lock = threading.Lock()
+_catalog_document: Optional[Tuple[ScoringCatalog, CatalogDocument]] = None
+
+
+# Reload the catalog from the database; call after the reference tables change
+def refresh_catalog(session=None) -> ScoringCatalog:
+    global _catalog
+    if session is None:
+        with get_session() as session:
+            catalog = ScoringCatalog.from_session(session)
+    else:
+        catalog = ScoringCatalog.from_session(session)
+    with _catalog_lock:
+        _catalog = catalog
+    return catalog
+
+
+# Return the current catalog, loading it on first use (with the caller's session if given)
+def get_catalog(session=None) -> ScoringCatalog:
+    catalog = _catalog
+    if catalog is None:
+        with _catalog_lock:
+            catalog = _catalog
+        if catalog is None:
+            catalog = refresh_catalog(session)
+    return catalog
+
+
+# The encoded /catalog response for the current catalog, rebuilt when the catalog is refreshed
+def get_catalog_document(session=None) -> CatalogDocument:
+    global _catalog_document
+    catalog = get_catalog(session)
+    cached = _catalog_document
+    if cached is None or cached[0] is not catalog:
+        cached = (catalog, build_catalog_document(catalog))
+        _catalog_document = cached
+    return cached[1]
@@ -0,0 +1,159 @@
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import csv
+import io
+
+import orjson
+from sqlmodel import select
+
+from catalog import ScoringCatalog
+from models import Building, get_session
+from scoring import impact_criteria, key_functionalities
+
+
+# Rows fetched from the database cursor at a time; each batch becomes one chunk of the response
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Plain Building columns, in export order
+METADATA_FIELDS = ("id", "building_name", "building_type", "building_usage", "building_state", "energy_class",
+                   "zone", "country", "city", "region", "street", "zip", "year", "owner_id")
+
+EXPORT_COLUMNS = tuple(getattr(Building, name) for name in METADATA_FIELDS) + (
+    Building.domains, Building.total_sri, Building.sri_scores, Building.levels)
+
+# The nested SRI results, flattened as "<group>.<key>" columns
+SCORE_GROUPS = ("smart_readiness_scores", "sr_impact_criteria", "sr_domains", "srf_scores")
+
+
+class ExportSchema:
+    """
+    The flat columns of a building export, fixed up front from the catalog
+    so that CSV and Parquet get one header / schema for the whole stream:
+    the metadata, the domains (joined with ";", None when there are none),
+    total_sri, one column per SRI score (e.g. "sr_domains.Heating") and one
+    per service level ("levels.H-1a.2", holding that level's percentage).
+    Scores or levels outside the catalog are left out. NDJSON rows leave out
+    empty columns.
+    """
+
+    def __init__(self, catalog: ScoringCatalog):
+        domains = list(catalog.levels_by_domain)
+        score_keys = {
+            "smart_readiness_scores": [f"{domain}-{ic}" for domain in domains for ic in impact_criteria],
+            "sr_impact_criteria": list(impact_criteria),
+            "sr_domains": domains,
+            "srf_scores": list(key_functionalities),
+        }
+        self.score_columns: List[Tuple[str, str, str]] = [
+            (f"{group}.{key}", group, key) for group in SCORE_GROUPS for key in score_keys[group]]
+        self.level_columns: List[Tuple[str, str, str]] = [
+            (f"levels.{code}.{level}", code, str(level))
+            for code in catalog.levels_by_code for level in range(catalog.max_level[code] + 1)]
+        self.columns: List[str] = (list(METADATA_FIELDS) + ["domains", "total_sri"]
+                                   + [name for name, _, _ in self.score_columns]
+                                   + [name for name, _, _ in self.level_columns])
+
+    # One database row as a flat dict, None for the scores and levels it doesn't have
+    # (or, when sparse, without them)
+    def flatten(self, row, sparse: bool = False) -> Dict[str, Any]:
+        flat = {name: value for name, value in zip(METADATA_FIELDS, row)}
+        domains, total_sri, sri_scores, levels = row[len(METADATA_FIELDS):]
+        flat["domains"] = ";".join(domains) if domains else None
+        flat["total_sri"] = total_sri
+        sri_scores = sri_scores or {}
+        for name, group, key in self.score_columns:
+            flat[name] = sri_scores.get(group, {}).get(key)
+        levels = levels or {}
+        for name, code, level in self.level_columns:
+            flat[name] = levels.get(code, {}).get(level)
+        if sparse:
+            return {name: value for name, value in flat.items() if value is not None}
+        return flat
+
+
+# Batches of building rows, read through a server-side cursor (yield_per) in a session of
+# its own, since the response outlives the request's session. Only the exported columns
+# are selected, so no ORM objects pile up in the session.
+def building_batches(owner_id: Optional[int]) -> Iterator[list]:
+    statement = select(*EXPORT_COLUMNS).order_by(Building.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    if owner_id is not None:
+        statement = statement.where(Building.owner_id == owner_id)
+    with get_session() as session:
+        for batch in session.execute(statement).partitions():
+            yield batch
+
+
+def ndjson_stream(schema: ExportSchema, owner_id: Optional[int]) -> Iterator[bytes]:
+    for batch in building_batches(owner_id):
+        yield b"".join(orjson.dumps(schema.flatten(row, sparse=True)) + b"\n" for row in batch)
+
+
+def csv_stream(schema: ExportSchema, owner_id: Optional[int]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=schema.columns)
+    writer.writeheader()
+    for batch in building_batches(owner_id):
+        writer.writerows(schema.flatten(row) for row in batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+# Write-only file object that hands what was written so far to the stream
+class _ChunkSink(io.RawIOBase):
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+# One Parquet row group per batch; needs pyarrow (check parquet_available first)
+def parquet_stream(schema: ExportSchema, owner_id: Optional[int]) -> Iterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {name: pa.string() for name in METADATA_FIELDS}
+    types.update(id=pa.int64(), owner_id=pa.int64(), domains=pa.string(), total_sri=pa.float64())
+    types.update({name: pa.float64() for name, _, _ in schema.score_columns})
+    types.update({name: pa.int64() for name, _, _ in schema.level_columns})
+    arrow_schema = pa.schema([(name, types[name]) for name in schema.columns])
+
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, arrow_schema) as writer:
+        for batch in building_batches(owner_id):
+            writer.write_table(pa.Table.from_pylist([schema.flatten(row) for row in batch], schema=arrow_schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+EXPORT_STREAMS = {"ndjson": ndjson_stream, "csv": csv_stream, "parquet": parquet_stream}
@@ -0,0 +1,262 @@
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+import importlib
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+
+from sqlalchemy import delete, func, update
+from sqlmodel import select
+
+from models import Job, engine, get_session
+
+
+logger = logging.getLogger(__name__)
+
+# How long an idle worker waits before looking for queued jobs again
+JOB_POLL_INTERVAL = float(os.getenv("SRI_JOB_POLL_INTERVAL", "1"))
+# Finished jobs, results included, are kept this many seconds and then deleted
+JOB_RETENTION = float(os.getenv("SRI_JOB_RETENTION", str(7 * 24 * 3600)))
+# A job runs for at most this many seconds
+JOB_TIMEOUT = float(os.getenv("SRI_JOB_TIMEOUT", "3600"))
+# A running job whose worker has not sent a heartbeat for this long is taken as abandoned
+JOB_STALE_AFTER = float(os.getenv("SRI_JOB_STALE_AFTER", "300"))
+JOB_HEARTBEAT_INTERVAL = 30
+# An abandoned job is queued again until it has been started this many times
+JOB_MAX_ATTEMPTS = int(os.getenv("SRI_JOB_MAX_ATTEMPTS", "3"))
+# How often a worker requeues abandoned jobs and deletes expired ones
+MAINTENANCE_INTERVAL = 60
+
+
+# Job kind -> handler(context) returning the JSON result; filled in by the app
+JOB_HANDLERS: Dict[str, Callable[["JobContext"], Any]] = {}
+
+
+# Raised by a handler for an expected failure; the message becomes the job's error
+class JobFailed(Exception):
+    pass
+
+
+# Raised by a handler that stopped because should_stop() said so
+class JobInterrupted(Exception):
+    pass
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+# Queue bookkeeping is plain SQL; objects already loaded in the session are left alone
+NO_SYNC = {"synchronize_session": False}
+
+
+class JobContext:
+    """
+    What a job handler works with: the job's payload, progress reporting and
+    the stop signal, set when the worker shuts down or the job's timeout
+    passes. Long handlers should poll should_stop() and raise JobInterrupted.
+    """
+
+    def __init__(self, job: Job, stop_event, timeout: float = JOB_TIMEOUT):
+        self.job_id = job.id
+        self.kind = job.kind
+        self.payload = job.payload or {}
+        self.deadline = time.monotonic() + timeout
+        self._stop_event = stop_event
+
+    @property
+    def timed_out(self) -> bool:
+        return time.monotonic() > self.deadline
+
+    def should_stop(self) -> bool:
+        return self._stop_event.is_set() or self.timed_out
+
+    def report_progress(self, done: int, total: Optional[int] = None):
+        values = {"progress_done": done, "heartbeat_at": utcnow()}
+        if total is not None:
+            values["progress_total"] = total
+        with get_session() as session:
+            session.execute(update(Job).where(Job.id == self.job_id).values(**values), execution_options=NO_SYNC)
+            session.commit()
+
+
+# Take the oldest queued job, or None. FOR UPDATE SKIP LOCKED keeps concurrent workers
+# off the same row on Postgres; the conditional UPDATE settles any race elsewhere.
+def claim_job(session, worker: str) -> Optional[Job]:
+    job_id = session.exec(
+        select(Job.id).where(Job.status == "queued").order_by(Job.id).limit(1).with_for_update(skip_locked=True)
+    ).first()
+    if job_id is None:
+        session.rollback()
+        return None
+    now = utcnow()
+    claimed = session.execute(
+        update(Job).where(Job.id == job_id, Job.status == "queued")
+        .values(status="running", worker=worker, started_at=now, heartbeat_at=now, attempts=Job.attempts + 1),
+        execution_options=NO_SYNC,
+    ).rowcount
+    session.commit()
+    return session.get(Job, job_id) if claimed else None
+
+
+def finish_job(session, job_id: int, status: str, result: Any = None, error: Optional[str] = None):
+    values = {"status": status, "result": result, "error": error, "finished_at": utcnow()}
+    if status == "succeeded":
+        values["progress_done"] = func.coalesce(Job.progress_total, Job.progress_done)
+    session.execute(update(Job).where(Job.id == job_id).values(**values), execution_options=NO_SYNC)
+    session.commit()
+
+
+def requeue_job(session, job_id: int):
+    session.execute(update(Job).where(Job.id == job_id)
+                    .values(status="queued", worker=None, started_at=None, heartbeat_at=None, progress_done=0),
+                    execution_options=NO_SYNC)
+    session.commit()
+
+
+# Queue the running jobs of dead workers again, or fail them once they ran out of attempts
+def recover_stale_jobs(session) -> int:
+    stale = (Job.status == "running") & (Job.heartbeat_at < utcnow() - timedelta(seconds=JOB_STALE_AFTER))
+    failed = session.execute(
+        update(Job).where(stale, Job.attempts >= JOB_MAX_ATTEMPTS)
+        .values(status="failed", error="The job's worker stopped responding", finished_at=utcnow()),
+        execution_options=NO_SYNC,
+    ).rowcount
+    requeued = session.execute(
+        update(Job).where(stale).values(status="queued", worker=None, started_at=None, heartbeat_at=None,
+                                        progress_done=0),
+        execution_options=NO_SYNC,
+    ).rowcount
+    session.commit()
+    return failed + requeued
+
+
+def purge_expired_jobs(session) -> int:
+    deleted = session.execute(
+        delete(Job).where(Job.finished_at < utcnow() - timedelta(seconds=JOB_RETENTION)),
+        execution_options=NO_SYNC,
+    ).rowcount
+    session.commit()
+    return deleted
+
+
+class JobWorker:
+    """
+    Runs queued jobs one at a time until stop_event is set. While a job runs
+    a heartbeat thread keeps its heartbeat_at fresh, so a job is only taken
+    as abandoned when its worker is gone. A job interrupted by shutdown is
+    put back in the queue; one that fails or times out is finished with
+    its error.
+    """
+
+    def __init__(self, stop_event, name: Optional[str] = None):
+        self.stop_event = stop_event
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self._next_maintenance = 0.0
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                if time.monotonic() >= self._next_maintenance:
+                    self._next_maintenance = time.monotonic() + MAINTENANCE_INTERVAL
+                    with get_session() as session:
+                        recover_stale_jobs(session)
+                        purge_expired_jobs(session)
+                with get_session() as session:
+                    job = claim_job(session, self.name)
+            except Exception:
+                logger.exception("Job queue unavailable")
+                job = None
+            if job is None:
+                self.stop_event.wait(JOB_POLL_INTERVAL)
+                continue
+            self.process(job)
+
+    def process(self, job: Job):
+        context = JobContext(job, self.stop_event)
+        heartbeat_stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job.id, heartbeat_stop), daemon=True)
+        heartbeat.start()
+        try:
+            handler = JOB_HANDLERS.get(job.kind)
+            if handler is None:
+                raise JobFailed(f"Unknown job kind: {job.kind}")
+            result = handler(context)
+        except Exception as exc:
+            if context.timed_out:
+                error = "The job took too long"
+            elif self.stop_event.is_set():
+                with get_session() as session:
+                    requeue_job(session, job.id)
+                return
+            elif isinstance(exc, JobFailed):
+                error = str(exc)
+            else:
+                logger.exception("Job %s (%s) failed", job.id, job.kind)
+                error = "Internal error"
+            with get_session() as session:
+                finish_job(session, job.id, "failed", error=error)
+        else:
+            with get_session() as session:
+                finish_job(session, job.id, "succeeded", result=result)
+        finally:
+            heartbeat_stop.set()
+            heartbeat.join()
+
+    def _heartbeat(self, job_id: int, stop: threading.Event):
+        while not stop.wait(JOB_HEARTBEAT_INTERVAL):
+            try:
+                with get_session() as session:
+                    session.execute(update(Job).where(Job.id == job_id).values(heartbeat_at=utcnow()),
+                                    execution_options=NO_SYNC)
+                    session.commit()
+            except Exception:
+                logger.exception("Heartbeat of job %s failed", job_id)
+
+
+def run_job_worker(stop_event, handlers_module: Optional[str] = None):
+    # Shutdown is driven by the parent through stop_event; Ctrl-C reaches the whole process group
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Connections inherited through fork belong to the parent; never reuse them here
+    engine.dispose(close=False)
+    if handlers_module:
+        importlib.import_module(handlers_module)
+    JobWorker(stop_event).run()
+
+
+class JobWorkerProcesses:
+    """
+    A fixed set of worker processes running JobWorker. With a start method
+    other than fork the children import handlers_module to register the
+    job handlers.
+    """
+
+    def __init__(self, count: int, handlers_module: Optional[str] = None, start_method: Optional[str] = None):
+        if start_method is None:
+            start_method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        self.count = count
+        self.handlers_module = handlers_module
+        self._mp_context = multiprocessing.get_context(start_method)
+        self._stop_event = self._mp_context.Event()
+        self._processes: List[multiprocessing.Process] = []
+
+    def start(self):
+        for i in range(self.count):
+            process = self._mp_context.Process(target=run_job_worker, name=f"sri-job-worker-{i}",
+                                               args=(self._stop_event, self.handlers_module), daemon=True)
+            process.start()
+            self._processes.append(process)
+
+    # Running jobs stop at their next should_stop() check and go back to the queue
+    def stop(self, timeout: float = 10):
+        self._stop_event.set()
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
@@ -1,15 +1,39 @@
-from fastapi import FastAPI, HTTPException, Depends, Request, Response
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel, EmailStr, constr
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import event, inspect, update
 from sqlalchemy.exc import SQLAlchemyError
-from models import get_session, Levels, Domain_W, Impact_W, Services, Building, person, pwd_context, create_db_and_tables, reset_and_load_data
+from models import get_db, get_async_db, engine, async_engine, Levels, Services, Building, Job, person, pwd_context, create_db_and_tables, get_session, load_reference_data
+from catalog import get_catalog, get_catalog_document, refresh_catalog
+from scoring import DomainScores, MissingWeightsError, get_scoring_engine, impact_criteria, store_domain_max_scores
+import scoring
+from upgrade import PlanningCancelled
+from planning import PlanningPool, PlanningPoolFull, PlanningTimeout, PlanningWorkerCrashed, plan_upgrade
+from building_import import IMPORT_FORMATS, import_buildings, import_format_for
+from analytics import ANALYTICS_GROUPS, SRIAnalytics
+from export import EXPORT_MEDIA_TYPES, EXPORT_STREAMS, ExportSchema, parquet_available
+from pagination import InvalidCursor, decode_cursor, encode_cursor, keyset_page
+from jobs import JOB_HANDLERS, JobContext, JobFailed, JobInterrupted, JobWorkerProcesses
+from passwords import HashingPoolFull, PasswordHashingPool
+from cache import TTLCache
+from result_cache import SRIResultCache, sri_input_key
+from metrics import METRICS_CONTENT_TYPE, QueryMetricsMiddleware, instrument_engine, metrics_response_body
+from tracing import ProfilingMiddleware, get_tracer, profiled
+import numpy as np
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from responses import ORJSONResponse, model_serializer
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
+import functools
 import logging
+import os
 
 
 
@@ -30,6 +54,50 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Scoring and upgrade planning are CPU bound; they run on their own pool so the event loop stays free
+SCORING_WORKERS = int(os.getenv("SRI_SCORING_WORKERS", str(min(4, os.cpu_count() or 1))))
+scoring_executor = ThreadPoolExecutor(max_workers=SCORING_WORKERS, thread_name_prefix="sri-scoring")
+
+# The work runs in a copy of the request's context, so tracing spans and profiling carry over
+async def run_scoring(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(scoring_executor, functools.partial(context.run, profiled, func, *args, **kwargs))
+
+# Upgrade planning runs in worker processes (0 keeps it on the scoring pool), each request
+# limited to SRI_PLANNING_TIMEOUT seconds and stopped early when its client disconnects
+PLANNING_WORKERS = int(os.getenv("SRI_PLANNING_WORKERS", str(min(4, os.cpu_count() or 1))))
+PLANNING_TIMEOUT = float(os.getenv("SRI_PLANNING_TIMEOUT", "30"))
+planning_pool = PlanningPool(max_workers=PLANNING_WORKERS,
+                             max_pending=int(os.getenv("SRI_PLANNING_MAX_PENDING", "64")),
+                             start_method=os.getenv("SRI_PLANNING_START_METHOD") or None) if PLANNING_WORKERS > 0 else None
+
+# Processes running the queued /jobs/ computations; with 0, jobs wait for workers started elsewhere
+JOB_WORKERS = int(os.getenv("SRI_JOB_WORKERS", "1"))
+JOB_CHUNK_SIZE = int(os.getenv("SRI_JOB_CHUNK_SIZE", "500"))
+job_workers = JobWorkerProcesses(JOB_WORKERS, handlers_module=__name__) if JOB_WORKERS > 0 else None
+
+# Argon2 hashing gets its own small pool, so a burst of logins cannot starve scoring
+password_pool = PasswordHashingPool(pwd_context,
+                                    max_workers=int(os.getenv("SRI_HASH_WORKERS", "2")),
+                                    max_pending=int(os.getenv("SRI_HASH_MAX_PENDING", "64")))
+
+# Also materialize lmax(d, ic) as the DomainMaxScore table, refreshed with the reference data, for
+# reporting and SQL users; scoring itself takes lmax from the in-memory engine
+STORE_DOMAIN_MAX_SCORES = os.getenv("SRI_STORE_DOMAIN_MAX_SCORES", "false").lower() in ("1", "true", "yes")
+
+# Results of identical SRI inputs, keyed by the input and the reference data version.
+# SRI_RESULT_CACHE_PATH adds a SQLite tier that outlives the process.
+result_cache = SRIResultCache(maxsize=int(os.getenv("SRI_RESULT_CACHE_SIZE", "4096")),
+                              sqlite_path=os.getenv("SRI_RESULT_CACHE_PATH") or None)
+
+def hashing_busy_exception():
+    return HTTPException(
+        status_code=503,
+        detail="Too many login requests, please try again",
+        headers={"Retry-After": "1"},
+    )
+
 
 app.add_middleware(
     CORSMiddleware,
@@ -37,8 +105,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+# Per-request database statement counts and timings: Server-Timing header and /metrics
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+app.add_middleware(QueryMetricsMiddleware)
+# Opt-in per-request profiling (X-SRI-Profile header with SRI_PROFILING on)
+app.add_middleware(ProfilingMiddleware)
+
 class UserCreate(BaseModel):
     username: str
     email: EmailStr
@@ -121,6 +197,12 @@ class SRIOutput(BaseModel):
     total_sri: float  # New field for the total SRI score
 
 
+# Serializers for the response models above, for data the app built itself: they give
+# the same JSON as response_model validation without validating every response again
+serialize_building_output = model_serializer(BuildingOutput)
+serialize_sri_output = model_serializer(SRIOutput)
+
+
 # Validate data before inserting into the database
 def validate_numeric_data(data):
     for key, value in data.items():
@@ -132,140 +214,12 @@ def validate_numeric_data(data):
                 raise ValueError(f"Invalid numeric value for {key}: {value}")
             
 
-def calculate_scores(user_input: SRIInput):
-    with get_session() as session:
-        domain_impact_scores = {}
-        domain_max_scores = {}  # To store Imax(d, ic)
-        smart_readiness_scores = {} #to store SR(d, ic) percentage
-
-        #domains = [ "Cooling", "Dynamic building envelope", "Domestic hot water", "Electricity", "Electric vehicle charging", "Heating", "Lighting", "Monitoring and control", "Ventilation"]
-
-        domains = user_input.dom
-
-        # Mandatory services mapping as per domain
-        mandatoryServices = {
-            'Heating': ['H-3', 'H-4'],
-            'Domestic hot water': ['DHW-3'],
-            'Cooling': ['C-1f', 'C-2a', 'C-3', 'C-4'],
-            'Ventilation': ['V-1a', 'V-6'],
-            'Lighting': ['L-1a', 'L-2'],
-            'Dynamic building envelope': ['DE-2'],
-            'Electricity': ['E-12'],
-            'Monitoring and control': ['MC-3', 'MC-4', 'MC-9', 'MC-13', 'MC-25', 'MC-28', 'MC-29', 'MC-30'],
-        }
-
-        impact_criteria = [
-            "Energy efficiency", "Energy, flexibility and storage", "Comfort", "Convenience", "Health, wellbeing and accessibility", 
-            "Maintenance and fault prediction", "Information to occupants"
-        ]      
-
-        # Loop over domains and impact criteria
-        for domain in domains:
-            # Initialize a dictionary to store the maximum scores for each impact criterion
-            max_scores = {ic: 0 for ic in impact_criteria}
-
-            # Get all levels in the current domain
-            domain_levels = session.query(Levels).filter(Levels.domain == domain).all()
-
-            # Create a dictionary to store the maximum level for each service code
-            max_level_for_service = {}
-
-            for level in domain_levels:
-                # Determine the maximum level for each service code
-                if level.code in user_input.lev:
-                    if level.code not in max_level_for_service or max_level_for_service[level.code] < level.level:
-                        max_level_for_service[level.code] = level.level
-
-            # Include mandatory services for the current domain
-            mandatory_services = mandatoryServices.get(domain, [])
-
-            for mandatory_service in mandatory_services:
-                # Get all levels for the mandatory service
-                mandatory_service_levels = session.query(Levels).filter(Levels.code == mandatory_service).all()
-                for level in mandatory_service_levels:
-                    if mandatory_service not in max_level_for_service or max_level_for_service[mandatory_service] < level.level:
-                        max_level_for_service[mandatory_service] = level.level
-            
-            #score_fields = [ "score_cr1", "score_cr2", "score_cr3", "score_cr4", "score_cr5", "score_cr6", "score_cr7"]
-
-            # Calculate the maximum score for each impact criterion
-            for ic in impact_criteria:
-
-                if ic == "Energy efficiency":
-                    score_field = "score_cr1"
-                if ic == "Energy, flexibility and storage":
-                    score_field = "score_cr2"
-                if ic == "Comfort":
-                    score_field = "score_cr3"
-                if ic == "Convenience":
-                    score_field = "score_cr4"
-                if ic == "Health, wellbeing and accessibility":
-                    score_field = "score_cr5"
-                if ic == "Maintenance and fault prediction":
-                    score_field = "score_cr6"
-                if ic == "Information to occupants":
-                    score_field = "score_cr7"
-
-                for service_code, max_level in max_level_for_service.items():
-                    # Find the level instance with the maximum level for this service
-                    max_level_instance = session.query(Levels).filter(
-                        Levels.code == service_code,
-                        Levels.level == max_level
-                    ).first()
-
-                    if max_level_instance:
-                        score = getattr(max_level_instance, score_field, 0)
-                        max_scores[ic] += score
-
-                # Store the calculated Imax(d, ic)
-                domain_max_scores[f"{domain}-{ic}"] = max_scores[ic]
-
-            # Now calculate the l(d, ic) score as before
-            for ic in impact_criteria:
-                total_score = 0
-
-                # Calculate the score based on the user's input
-                for level in domain_levels:
-                    level_input = user_input.lev.get(level.code)  # Get the user input level
-                    if level_input:  # Match the user input with the level
-
-
-                        # Get the score for the corresponding impact criteria
-                        if ic == "Energy efficiency":
-                            score_field = "score_cr1"
-                        if ic == "Energy, flexibility and storage":
-                            score_field = "score_cr2"
-                        if ic == "Comfort":
-                            score_field = "score_cr3"
-                        if ic == "Convenience":
-                            score_field = "score_cr4"
-                        if ic == "Health, wellbeing and accessibility":
-                            score_field = "score_cr5"
-                        if ic == "Maintenance and fault prediction":
-                            score_field = "score_cr6"
-                        if ic == "Information to occupants":
-                            score_field = "score_cr7"
-
-                        level_scores = []
-                        for user_level, percentage in level_input.items():
-                            if level.level == user_level:
-                                score = getattr(level, score_field, 0) * (percentage / 100)
-                                level_scores.append(score)
-                        total_score += sum(level_scores)
-
-                domain_impact_scores[f"{domain}-{ic}"] = total_score
-        
-        # Calculate SR(d, ic) as (l(d, ic) / lmax(d, ic)) * 100
-        for key in domain_impact_scores:
-            l_score = domain_impact_scores[key]
-            lmax_score = domain_max_scores[key]
-            if lmax_score != 0:  # Avoid division by zero
-                smart_readiness_score = (l_score / lmax_score) * 100
-            else:
-                smart_readiness_score = 0  # If lmax_score is zero, SR is 0
-
-            smart_readiness_scores[key] = round(smart_readiness_score, 2)  # Round to two decimal places
+def calculate_scores(user_input: SRIInput, session: Optional[Session] = None):
+    # l(d, ic) and lmax(d, ic) for the present domains, one row per domain
+    domain_impact_scores, domain_max_scores = get_scoring_engine(session).domain_scores(user_input.dom, user_input.lev)
 
+    # Calculate SR(d, ic) as (l(d, ic) / lmax(d, ic)) * 100
+    smart_readiness_scores = scoring.smart_readiness_scores(domain_impact_scores, domain_max_scores)
 
     return {
             "domain_impact_scores": domain_impact_scores,
@@ -275,100 +229,21 @@ def calculate_scores(user_input: SRIInput):
 
 
 # Function to calculate the weighted sums for each impact criterion
-def calculate_weighted_sums(user_input: SRIInput, impact_scores: Dict[str, int]):
-    with get_session() as session:
-        
+def calculate_weighted_sums(user_input: SRIInput, impact_scores: DomainScores, session: Optional[Session] = None):
+    # Get the correct weights based on the building type and zone
+    try:
+        domain_weights = get_scoring_engine(session).domain_weights(user_input.building_type, user_input.zone, impact_scores.domains)
+    except MissingWeightsError:
+        raise HTTPException(status_code=400, detail="No weights found for the given zone and building type")
 
-        impact_criteria = [
-            "Energy efficiency", "Energy, flexibility and storage", "Comfort", "Convenience", "Health, wellbeing and accessibility", 
-            "Maintenance and fault prediction", "Information to occupants"
-        ]
+    weighted_sums = scoring.weighted_sums(domain_weights, impact_scores.values)
+    return dict(zip(impact_criteria, weighted_sums.tolist()))
 
-        # Initialize the weighted sums dictionary
-        weighted_sums = {ic: 0 for ic in impact_criteria}
-
-        # Loop through the domain-impact scores and calculate the weighted sums
-        for key, score in impact_scores.items():
-            try:
-                domain, impact_criterion = key.split("-")  # Split the key into domain and impact criterion
-            except ValueError:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Invalid key structure: '{key}'. Expected format 'Domain-ImpactCriterion'"
-                )
-            
-                # Get the correct weights based on the building type and zone
-            domain_weights = session.query(Domain_W).filter(
-                Domain_W.building_type == user_input.building_type,
-                Domain_W.zone == user_input.zone,
-                Domain_W.domain == domain
-            ).first()
-
-            if not domain_weights:
-                raise HTTPException(status_code=400, detail="No weights found for the given zone and building type")
-
-            # Ensure the impact_criterion is valid
-            if impact_criterion not in impact_criteria:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Unknown impact criterion: '{impact_criterion}'."
-                )
-
-            # Get the correct weight for the given impact criterion
-            if impact_criterion == "Energy efficiency":
-                    weight_field = "dw_cr1"
-            if impact_criterion == "Energy, flexibility and storage":
-                    weight_field = "dw_cr2"
-            if impact_criterion == "Comfort":
-                    weight_field = "dw_cr3"
-            if impact_criterion == "Convenience":
-                    weight_field = "dw_cr4"
-            if impact_criterion == "Health, wellbeing and accessibility":
-                    weight_field = "dw_cr5"
-            if impact_criterion == "Maintenance and fault prediction":
-                    weight_field = "dw_cr6"
-            if impact_criterion == "Information to occupants":
-                    weight_field = "dw_cr7"
-            #weight_index = impact_criteria.index(impact_criterion) + 1  # dw_cr1, dw_cr2, etc.
-            weight = getattr(domain_weights, weight_field, 1)
-            weighted_sums[impact_criterion] += weight * score
-
-        return weighted_sums
-
-
-# Adding fixed weights for the impact criteria
-impact_weights = {
-    "Energy efficiency": 0.5,
-    "Energy, flexibility and storage": 1,
-    "Comfort": 0.25,
-    "Convenience": 0.25,
-    "Health, wellbeing and accessibility": 0.25,
-    "Maintenance and fault prediction": 0.5,
-    "Information to occupants": 0.25
-}
-
-# Define the key functionalities and their associated impact criteria
-key_functionalities = {
-    "Energy Performance and Operation": ["Energy efficiency", "Maintenance and fault prediction"],
-    "Response to User Needs": ["Comfort", "Convenience", "Information to occupants", "Health, wellbeing and accessibility"],
-    "Energy Flexibility": ["Energy, flexibility and storage"]
-}
 
 # Function to calculate weighted domain sums
-def calculate_weighted_domain_sums(domain_impact_scores):
-    weighted_domain_sums = {}  # Initialize the weighted sums for each domain
-    
-    # Loop through the domain-impact scores
-    for key, score in domain_impact_scores.items():
-        domain, impact_criterion = key.split("-")
-        
-        if domain not in weighted_domain_sums:
-            weighted_domain_sums[domain] = 0
-        
-        # Add weighted score to the domain's total
-        weighted_domain_sums[domain] += impact_weights[impact_criterion] * score
-
-    return weighted_domain_sums
+def calculate_weighted_domain_sums(domain_impact_scores: DomainScores):
+    weighted_domain_sums = scoring.weighted_domain_sums(domain_impact_scores.values)
+    return dict(zip(domain_impact_scores.domains, weighted_domain_sums.tolist()))
 
 
 # Function to calculate SR for each domain
@@ -391,39 +266,31 @@ def calculate_sr_domains(weighted_domain_sums, weighted_max_domain_sums):
 
 # Function to calculate SRf scores for each key functionality
 def calculate_srf_scores(sr_impact_criteria):
-    srf_scores = {}  # Initialize the SRf scores dictionary
-    
-    # Calculate the weighted SRf score for each key functionality
-    for key_func, impact_criteria in key_functionalities.items():
-        srf_score = 0
-        
-        # Sum the weighted SR(ic) for each impact criterion within the key functionality
-        for impact_criterion in impact_criteria:
-            if impact_criterion in sr_impact_criteria:  # Corrected key reference
-                srf_score += impact_weights[impact_criterion] * sr_impact_criteria[impact_criterion]
-        
-        # Convert to percentage and round to two decimal places
-        srf_scores[key_func] = round(srf_score, 2)
-
-    return srf_scores
+    return scoring.srf_scores(np.array([sr_impact_criteria.get(ic, 0) for ic in impact_criteria], dtype=np.float64))
 
 
 # Function to calculate the total SRI score
 def calculate_total_sri(srf_scores: Dict[str, float]):
-    # Weights for each key functionality
-    weight = 1 / 3  # Equal weight for each key functionality
-    
-    total_sri = 0
+    return scoring.total_sri(srf_scores)
 
-    # Sum weighted SRf scores
-    for key in srf_scores:
-        total_sri += srf_scores[key] * weight
-    
-    return round(total_sri, 2)  # Round to two decimal places
 
+# Users resolved from tokens, keyed by username (the token subject). Entries are
+# dropped when the user row changes; the TTL bounds staleness across workers.
+user_cache = TTLCache(maxsize=int(os.getenv("SRI_USER_CACHE_SIZE", "1024")),
+                      ttl=float(os.getenv("SRI_USER_CACHE_TTL", "60")))
 
-# Dependency to get the current user
-async def get_current_user(token: str = Depends(oauth2_scheme)):
+@event.listens_for(person, "after_insert")
+@event.listens_for(person, "after_update")
+@event.listens_for(person, "after_delete")
+def invalidate_cached_user(mapper, connection, target):
+    # Drop the old username too when it was renamed
+    history = inspect(target).attrs.username.history
+    for username in (target.username, *(history.deleted or ())):
+        user_cache.pop(username)
+
+
+# Dependency to get the username from the bearer token
+def get_token_username(token: str = Depends(oauth2_scheme)) -> str:
     credentials_exception = HTTPException(
         status_code=401,
         detail="Could not validate credentials",
@@ -437,61 +304,73 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    with get_session() as session:
-        user = session.query(person).filter(person.username == token_data.username).first()
-        if user is None:
-            raise credentials_exception
+    return token_data.username
+
+# Dependency to get the current user
+async def get_current_user(username: str = Depends(get_token_username), session: AsyncSession = Depends(get_async_db)):
+    user = user_cache.get(username)
+    if user is not None:
+        return user
+    user = (await session.exec(select(person).where(person.username == username))).first()
+    if user is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    # Detach it so the cached copy outlives this request's session
+    session.expunge(user)
+    user_cache.set(username, user)
     return user
 
 # Endpoint to add a new building
 @app.post("/add_building/")
-def add_building(input_data: BuildingInput, request: Request, response: Response, current_user: person = Depends(get_current_user)):
+async def add_building(input_data: BuildingInput, request: Request, response: Response, current_user: person = Depends(get_current_user), session: AsyncSession = Depends(get_async_db)):
     try:
-        with get_session() as session:
-            building = Building(
-                building_name = input_data.building_name,
-                building_type=input_data.building_type,
-                zone=input_data.zone,
-                country=input_data.country,
-                city=input_data.city,
-                #domains=input_data.domains,  # Add domains to the building creation
-                owner_id=current_user.id,
-                year=input_data.year,
-                building_usage = input_data.building_usage,
-                building_state = input_data.building_state,
-                energy_class = input_data.energy_class,
-                region = input_data.region,
-                street = input_data.street,
-                zip = input_data.zip
-            )
-            session.add(building)
-            session.commit()
-            session.refresh(building)  # Ensure the building object is refreshed to get the ID
-            response.set_cookie(key="current_building", value=building.building_name)
-            return building
-            #return {"message": "Building added successfully", "building": building}
+        building = Building(
+            building_name = input_data.building_name,
+            building_type=input_data.building_type,
+            zone=input_data.zone,
+            country=input_data.country,
+            city=input_data.city,
+            #domains=input_data.domains,  # Add domains to the building creation
+            owner_id=current_user.id,
+            year=input_data.year,
+            building_usage = input_data.building_usage,
+            building_state = input_data.building_state,
+            energy_class = input_data.energy_class,
+            region = input_data.region,
+            street = input_data.street,
+            zip = input_data.zip
+        )
+        session.add(building)
+        await session.commit()
+        await session.refresh(building)  # Ensure the building object is refreshed to get the ID
+        response.set_cookie(key="current_building", value=building.building_name)
+        return building
+        #return {"message": "Building added successfully", "building": building}
     except SQLAlchemyError as e:
-            session.rollback()
+            await session.rollback()
             logging.error(f"Database error: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
     except Exception as e:
-            session.rollback()
+            await session.rollback()
             logging.error(f"An unexpected error occurred: {str(e)}")
             raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
 # Get current building endpoint
 @app.get("/current_building/", response_model=BuildingOutput)
-def get_current_building(request: Request, current_user: person = Depends(get_current_user)):
+async def get_current_building(request: Request, current_user: person = Depends(get_current_user), session: AsyncSession = Depends(get_async_db)):
     current_building_name = request.cookies.get("current_building")
     if not current_building_name:
         raise HTTPException(status_code=404, detail="No current building set")
     
-    with get_session() as session:
-        building = session.query(Building).filter(Building.building_name == current_building_name, Building.owner_id == current_user.id).first()
-        if not building:
-            raise HTTPException(status_code=404, detail="Building not found")
-    
-    return building
+    statement = select(Building).where(Building.building_name == current_building_name, Building.owner_id == current_user.id)
+    building = (await session.exec(statement)).first()
+    if not building:
+        raise HTTPException(status_code=404, detail="Building not found")
+
+    return ORJSONResponse(serialize_building_output(building))
 
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
@@ -504,57 +383,77 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def authenticate_user(username: str, password: str, session: Session):
-    user = session.query(person).filter(person.username == username).first()
+async def authenticate_user(username: str, password: str, session: AsyncSession):
+    user = (await session.exec(select(person).where(person.username == username))).first()
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    # Argon2 is deliberately slow; verify on the hashing pool so other requests keep running
+    if not await password_pool.verify(password, user.hashed_password):
         return False
     return user
 
 # Sign-up endpoint
 @app.post("/signup/")
-async def sign_up(user: UserCreate):
-    with get_session() as session:
-        try:
-            print(f"Received signup request: {user}")
-            hashed_password = get_password_hash(user.password)
-            db_user = person(username=user.username, email=user.email, hashed_password=hashed_password)
-            session.add(db_user)
-            session.commit()
-            return {"message": "User created successfully"}
-        except SQLAlchemyError as e:
-            session.rollback()
-            print(f"Database error: {e}")
-            raise HTTPException(status_code=400, detail="Username or email already exists")
-        except Exception as e:
-            session.rollback()
-            print(f"Unexpected error: {e}")
-            raise HTTPException(status_code=500, detail="An unexpected error occurred")
+async def sign_up(user: UserCreate, session: AsyncSession = Depends(get_async_db)):
+    try:
+        print(f"Received signup request: {user}")
+        hashed_password = await password_pool.hash(user.password)
+        db_user = person(username=user.username, email=user.email, hashed_password=hashed_password)
+        session.add(db_user)
+        await session.commit()
+        return {"message": "User created successfully"}
+    except HashingPoolFull:
+        raise hashing_busy_exception()
+    except SQLAlchemyError as e:
+        await session.rollback()
+        print(f"Database error: {e}")
+        raise HTTPException(status_code=400, detail="Username or email already exists")
+    except Exception as e:
+        await session.rollback()
+        print(f"Unexpected error: {e}")
+        raise HTTPException(status_code=500, detail="An unexpected error occurred")
 
 # Token endpoint
 @app.post("/token", response_model=Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    with get_session() as session:
-        user = authenticate_user(form_data.username, form_data.password, session)
-        if not user:
-            raise HTTPException(
-                status_code=401,
-                detail="Incorrect username or password",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-        access_token = create_access_token(
-            data={"sub": user.username}, expires_delta=access_token_expires
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), session: AsyncSession = Depends(get_async_db)):
+    try:
+        user = await authenticate_user(form_data.username, form_data.password, session)
+    except HashingPoolFull:
+        raise hashing_busy_exception()
+    if not user:
+        raise HTTPException(
+            status_code=401,
+            detail="Incorrect username or password",
+            headers={"WWW-Authenticate": "Bearer"},
         )
-        return {"access_token": access_token, "token_type": "bearer"}
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data={"sub": user.username}, expires_delta=access_token_expires
+    )
+    return {"access_token": access_token, "token_type": "bearer"}
+
+
+# Prometheus metrics: per-route request duration, database statements and database time
+@app.get("/metrics")
+def prometheus_metrics():
+    return Response(content=metrics_response_body(), media_type=METRICS_CONTENT_TYPE)
+
+# Queueing and timing counters of the password hashing pool
+@app.get("/metrics/password-hashing")
+def password_hashing_metrics():
+    return password_pool.stats()
 
+# Hit and miss counters of the SRI result cache
+@app.get("/metrics/result-cache")
+def result_cache_metrics():
+    return result_cache.stats()
+
+# Job counters of the upgrade planning process pool
+@app.get("/metrics/planning")
+def planning_metrics():
+    if planning_pool is None:
+        return {"max_workers": 0}
+    return planning_pool.stats()
 
 # Example protected route
 @app.get("/users/me/")
@@ -562,76 +461,176 @@ async def read_users_me(current_user: person = Depends(get_current_user)):
     return current_user
 
 @app.get("/users/{username}")
-async def read_user(username: str):
-    with get_session() as session:
-        user = session.query(person).filter(person.username == username).first()
-        if user is None:
-            raise HTTPException(status_code=404, detail="User not found")
-        return user
+async def read_user(username: str, session: AsyncSession = Depends(get_async_db)):
+    user = (await session.exec(select(person).where(person.username == username))).first()
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
 
 @app.get("/profile/", response_model=person)
 def read_profile(current_user: person = Depends(get_current_user)):
     return current_user
 
-# Endpoint to retrieve buildings for the logged-in user
+# Columns /my_buildings/ can return with fields=; the JSON blobs only when asked for
+BUILDING_FIELDS = ("id", "building_name", "building_type", "building_usage", "building_state", "energy_class",
+                   "zone", "country", "city", "region", "street", "zip", "year", "domains", "owner_id",
+                   "total_sri", "sri_scores", "levels")
+DEFAULT_BUILDING_FIELDS = tuple(name for name in BUILDING_FIELDS if name not in ("sri_scores", "levels"))
+BUILDING_SORTS = ("id", "building_name", "total_sri", "zone", "building_type", "energy_class", "year")
+MAX_PAGE_SIZE = 1000
+
+# Endpoint to retrieve buildings for the logged-in user, one page at a time: the list holds up to
+# limit buildings, and the X-Next-Cursor header, when present, is the cursor= of the next page
 @app.get("/my_buildings/")
-def get_user_buildings(token: str = Depends(oauth2_scheme)):
+async def get_user_buildings(fields: Optional[str] = None, sort: str = "id",
+                             limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[str] = None,
+                             zone: Optional[List[str]] = Query(None),
+                             building_type: Optional[List[str]] = Query(None),
+                             energy_class: Optional[List[str]] = Query(None),
+                             year: Optional[List[str]] = Query(None),
+                             min_total_sri: Optional[float] = None, max_total_sri: Optional[float] = None,
+                             current_user: person = Depends(get_current_user),
+                             session: AsyncSession = Depends(get_async_db)):
+    names = DEFAULT_BUILDING_FIELDS
+    if fields is not None:
+        names = tuple(dict.fromkeys(["id"] + [name.strip() for name in fields.split(",") if name.strip()]))
+    unknown = [name for name in names if name not in BUILDING_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    descending = sort.startswith("-")
+    sort_name = sort.lstrip("-")
+    if sort_name not in BUILDING_SORTS:
+        raise HTTPException(status_code=400, detail=f"Cannot sort by {sort_name}, use one of: {', '.join(BUILDING_SORTS)}")
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-    
-    with get_session() as session:
-        user = session.query(person).filter(person.username == username).first()
-        if user is None:
-            raise HTTPException(status_code=404, detail="User not found")
+        after = decode_cursor(cursor, sort) if cursor else None
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    columns = [getattr(Building, name) for name in dict.fromkeys(names + (sort_name,))]
+    statement = select(*columns).where(Building.owner_id == current_user.id)
+    for name, values in (("zone", zone), ("building_type", building_type), ("energy_class", energy_class),
+                         ("year", year)):
+        if values:
+            statement = statement.where(getattr(Building, name).in_(values))
+    if min_total_sri is not None:
+        statement = statement.where(Building.total_sri >= min_total_sri)
+    if max_total_sri is not None:
+        statement = statement.where(Building.total_sri <= max_total_sri)
+    statement = keyset_page(statement, getattr(Building, sort_name), Building.id, descending, after).limit(limit + 1)
+
+    rows = [row._mapping for row in (await session.exec(statement)).all()]
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(sort, rows[-1][sort_name], rows[-1]["id"])
+    return ORJSONResponse([{name: row[name] for name in names} for row in rows], headers=headers)
+
+# Import many buildings (and optionally score them) from an uploaded CSV or NDJSON file in one
+# request; see building_import.py for the columns. Rejected rows are listed in the report.
+@app.post("/buildings/import")
+async def import_buildings_file(file: UploadFile, import_format: Optional[str] = Query(None, alias="format"),
+                                score: bool = False, current_user: person = Depends(get_current_user)):
+    import_format = import_format or import_format_for(file.filename, file.content_type)
+    if import_format not in IMPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown import format, use one of: {', '.join(IMPORT_FORMATS)}")
+
+    report = await run_scoring(import_buildings, file.file, import_format, current_user.id, score)
+    return ORJSONResponse(report)
+
+
+# Stream the user's buildings (every building, for admins) with their SRI results and service
+# levels flattened into columns, as NDJSON, CSV or Parquet, without loading them all at once
+@app.get("/buildings/export")
+async def export_buildings(export_format: str = Query("ndjson", alias="format"),
+                           current_user: person = Depends(get_current_user)):
+    if export_format not in EXPORT_STREAMS:
+        raise HTTPException(status_code=400, detail=f"Unknown export format, use one of: {', '.join(EXPORT_STREAMS)}")
+    if export_format == "parquet" and not parquet_available():
+        raise HTTPException(status_code=501, detail="Parquet export needs pyarrow installed")
+
+    schema = ExportSchema(get_catalog())
+    owner_id = None if current_user.is_admin else current_user.id
+    return StreamingResponse(
+        EXPORT_STREAMS[export_format](schema, owner_id),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="buildings.{export_format}"'},
+    )
 
-        buildings = session.query(Building).filter(Building.owner_id == user.id).all()
-        return buildings
+# Portfolio statistics of the user's scored buildings (every building, for admins), optionally per
+# zone, building_type, energy_class, region or year; aggregated by the database, not loaded here
+@app.get("/analytics/sri")
+async def sri_analytics(group_by: Optional[str] = None, current_user: person = Depends(get_current_user),
+                        session: AsyncSession = Depends(get_async_db)):
+    if group_by is not None and group_by not in ANALYTICS_GROUPS:
+        raise HTTPException(status_code=400, detail=f"Cannot group by {group_by}, use one of: {', '.join(ANALYTICS_GROUPS)}")
+    analytics = SRIAnalytics(get_catalog(), group_by, None if current_user.is_admin else current_user.id)
+    summary_rows = (await session.exec(analytics.summary_statement())).all()
+    histogram_rows = (await session.exec(analytics.histogram_statement())).all()
+    return ORJSONResponse(analytics.report(summary_rows, histogram_rows))
 
 @app.get("/services/{domain_name}")
-def get_services(domain_name: str):
-    with get_session() as session:
-        statement = select(Services).distinct(Services.code, Services.service_desc).where(
-            Services.domain == domain_name,
-            ~Services.service_desc.like('User defined smart ready service%'))
-        results = session.exec(statement).all()
-        return JSONResponse(content=[result.dict() for result in results])
+def get_services(domain_name: str, session: Session = Depends(get_db)):
+    statement = select(Services).distinct(Services.code, Services.service_desc).where(
+        Services.domain == domain_name,
+        ~Services.service_desc.like('User defined smart ready service%'))
+    results = session.exec(statement).all()
+    return ORJSONResponse(content=[result.model_dump() for result in results])
 
 @app.get("/levels/{service_code}")
-def get_levels(service_code: str):
-    with get_session() as session:
-        statement = select(Levels).distinct(Levels.level_desc, Levels.description, Levels.code, Levels.level).where(Levels.code == service_code)
-        results = session.exec(statement).all()
-        return JSONResponse(content=[result.dict() for result in results])
+def get_levels(service_code: str, session: Session = Depends(get_db)):
+    statement = select(Levels).distinct(Levels.level_desc, Levels.description, Levels.code, Levels.level).where(Levels.code == service_code)
+    results = session.exec(statement).all()
+    return ORJSONResponse(content=[result.model_dump() for result in results])
+
+
+# How long browsers may reuse /catalog before revalidating it with its ETag
+CATALOG_MAX_AGE = int(os.getenv("SRI_CATALOG_MAX_AGE", "300"))
+
+# If-None-Match check; weak and strong tags compare equal, as RFC 9110 asks for this header
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+# All domains with their services and levels in one response, served from memory.
+# The ETag is the reference data version, so it only changes when the CSVs are reloaded.
+@app.get("/catalog")
+async def read_catalog(request: Request):
+    document = get_catalog_document()
+    headers = {"ETag": document.etag, "Cache-Control": f"public, max-age={CATALOG_MAX_AGE}"}
+    if etag_matches(request.headers.get("if-none-match"), document.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=document.body, media_type="application/json", headers=headers)
 
 
 @app.post("/save_sri_levels/")
 def save_sri_levels(sri_levels: SRIInput):    
-    with get_session() as session:
-        # Create the JSON structure
-        sri_json = {
-            "building_type": sri_levels.building_type,
-            "zone": sri_levels.zone,
-            "lev": sri_levels.lev
-        }
+    # Create the JSON structure
+    sri_json = {
+        "building_type": sri_levels.building_type,
+        "zone": sri_levels.zone,
+        "lev": sri_levels.lev
+    }
     return JSONResponse(sri_json)
     #return {"message": "SRI levels saved successfully", "sri_json": sri_json}
     
 
-@app.post("/calculate-sri/{building_id}/", response_model=SRIOutput)
-def calculate_sri(building_id: int, user_input: SRIInput):
-
+# The SRI of one configuration; runs on the scoring pool. Each stage is a tracer span.
+def compute_sri(user_input: SRIInput):
+    tracer = get_tracer()
     try:
-        validate_numeric_data(user_input.lev)  # Validate numeric fields
+        with tracer.span("sri.validation"):
+            validate_numeric_data(user_input.lev)  # Validate numeric fields
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
     try:
         # Calculate the domain-impact criteria scores and additional metrics
-        calculated_scores = calculate_scores(user_input)
+        with tracer.span("sri.calculate_scores", domains=len(user_input.dom), services=len(user_input.lev)):
+            calculated_scores = calculate_scores(user_input)
         
         # Ensure returned value is a dictionary
         if not isinstance(calculated_scores, dict):
@@ -642,35 +641,39 @@ def calculate_sri(building_id: int, user_input: SRIInput):
         smart_readiness_scores = calculated_scores.get("smart_readiness_scores", {})
 
         # Calculate the weighted sums for each impact criterion
-        weighted_sums = calculate_weighted_sums(user_input, domain_impact_scores)
-        weighted_max_sums = calculate_weighted_sums(user_input, domain_max_scores)
+        with tracer.span("sri.weighted_sums"):
+            weighted_sums = calculate_weighted_sums(user_input, domain_impact_scores)
+        with tracer.span("sri.weighted_max_sums"):
+            weighted_max_sums = calculate_weighted_sums(user_input, domain_max_scores)
         
-        sr_impact_criteria = {}  # New dictionary for SR(ic) percentages
+        with tracer.span("sri.srf_total"):
+            sr_impact_criteria = {}  # New dictionary for SR(ic) percentages
 
-        # Calculate SR(ic) as (weighted_sums[ic] / weighted_max_sums[ic]) * 100
-        for ic in weighted_sums:
-            weighted_sum = weighted_sums[ic]
-            weighted_max_sum = weighted_max_sums[ic]
+            # Calculate SR(ic) as (weighted_sums[ic] / weighted_max_sums[ic]) * 100
+            for ic in weighted_sums:
+                weighted_sum = weighted_sums[ic]
+                weighted_max_sum = weighted_max_sums[ic]
 
-            if weighted_max_sum != 0:
-                sr_percentage = (weighted_sum / weighted_max_sum) * 100
-            else:
-                sr_percentage = 0  # Default to zero if division by zero risk
+                if weighted_max_sum != 0:
+                    sr_percentage = (weighted_sum / weighted_max_sum) * 100
+                else:
+                    sr_percentage = 0  # Default to zero if division by zero risk
 
-            sr_impact_criteria[ic] = round(sr_percentage, 2)  # Round to two decimal places
+                sr_impact_criteria[ic] = round(sr_percentage, 2)  # Round to two decimal places
 
-        # Calculate SRf scores for each key functionality
-        srf_scores = calculate_srf_scores(sr_impact_criteria)
+            # Calculate SRf scores for each key functionality
+            srf_scores = calculate_srf_scores(sr_impact_criteria)
 
-        # Calculate the total SRI score
-        total_sri = calculate_total_sri(srf_scores)
+            # Calculate the total SRI score
+            total_sri = calculate_total_sri(srf_scores)
 
-        # Calculate the weighted sums for each domain
-        weighted_domain_sums = calculate_weighted_domain_sums(domain_impact_scores)
-        weighted_max_domain_sums = calculate_weighted_domain_sums(domain_max_scores)
-        
-        # Calculate SR(d) for each domain
-        sr_domains = calculate_sr_domains(weighted_domain_sums, weighted_max_domain_sums)
+        with tracer.span("sri.domain_sums"):
+            # Calculate the weighted sums for each domain
+            weighted_domain_sums = calculate_weighted_domain_sums(domain_impact_scores)
+            weighted_max_domain_sums = calculate_weighted_domain_sums(domain_max_scores)
+            
+            # Calculate SR(d) for each domain
+            sr_domains = calculate_sr_domains(weighted_domain_sums, weighted_max_domain_sums)
 
 
     except SQLAlchemyError as e:
@@ -679,255 +682,292 @@ def calculate_sri(building_id: int, user_input: SRIInput):
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
     # Return all expected results
-    sri_result = {
+    return {
         "smart_readiness_scores": smart_readiness_scores,
         "sr_impact_criteria": sr_impact_criteria,  
         "sr_domains": sr_domains,
         "srf_scores": srf_scores,
         "total_sri": total_sri
     }
-    # Save the results to the building
-    with get_session() as session:
-        building = session.get(Building, building_id)
-        if building:
-            building.sri_scores = sri_result
-            building.total_sri = total_sri
-            building.levels = user_input.lev
-            session.add(building)
-            session.commit()
-    
-    return sri_result
-
-@app.put("/buildings/{building_id}/domains", response_model=BuildingOutput)
-def update_building_domains(building_id: int, response: Response, domains_data: UpdateBuildingDomains):
-    with get_session() as session:
-        statement = select(Building).where(Building.id == building_id)
-        results = session.exec(statement)
-        building = results.one_or_none()
 
-        if not building:
-            raise HTTPException(status_code=404, detail="Building not found")
 
-        building.domains = domains_data.domains
-        session.add(building)
-        session.commit()
-        session.refresh(building)
+# compute_sri behind the result cache: identical inputs on the same reference data are scored once
+def cached_compute_sri(user_input: SRIInput):
+    version = get_catalog().version
+    key = sri_input_key(user_input.building_type, user_input.zone, user_input.dom, user_input.lev, version)
+    sri_result = result_cache.get(key)
+    if sri_result is None:
+        sri_result = compute_sri(user_input)
+        result_cache.set(key, sri_result, version)
+    return sri_result
 
-    return building
 
-@app.get("/building/{building_id}/sri_scores/", response_model=SRIOutput)
-def get_sri_scores(building_id: int):
-    with get_session() as session:
-        building = session.get(Building, building_id)
-        if not building or not building.sri_scores:
-            raise HTTPException(status_code=404, detail="SRI scores not found for this building")
-        
-        return building.sri_scores
+@app.post("/calculate-sri/{building_id}/", response_model=SRIOutput)
+async def calculate_sri(building_id: int, user_input: SRIInput, session: AsyncSession = Depends(get_async_db)):
+    tracer = get_tracer()
+    with tracer.span("calculate_sri", building_id=building_id):
+        sri_result = await run_scoring(cached_compute_sri, user_input)
+
+        # Save the results to the building
+        with tracer.span("sri.persistence"):
+            building = await session.get(Building, building_id)
+            if building:
+                building.sri_scores = sri_result
+                building.total_sri = sri_result["total_sri"]
+                building.levels = user_input.lev
+                session.add(building)
+                await session.commit()
+
+    return ORJSONResponse(serialize_sri_output(sri_result))
+
+# One building of a batch calculation
+class BatchSRIItem(BaseModel):
+    building_id: int
+    sri_input: SRIInput
+
+class BatchSRIResult(BaseModel):
+    building_id: int
+    result: Optional[SRIOutput] = None
+    error: Optional[str] = None
+
+
+# Score every building of a batch against the shared reference data; runs on the scoring pool
+def score_batch(items: List[BatchSRIItem], existing_ids):
+    scoring_engine = get_scoring_engine()
+    version = scoring_engine.catalog.version
+    results = []
+    updates = []
+    for item in items:
+        if item.building_id not in existing_ids:
+            results.append({"building_id": item.building_id, "result": None, "error": "Building not found"})
+            continue
+        user_input = item.sri_input
+        try:
+            validate_numeric_data(user_input.lev)
+            key = sri_input_key(user_input.building_type, user_input.zone, user_input.dom, user_input.lev, version)
+            sri_result = result_cache.get(key)
+            if sri_result is None:
+                sri_result = scoring_engine.evaluate(user_input.building_type, user_input.zone,
+                                                     user_input.dom, user_input.lev)
+                result_cache.set(key, sri_result, version)
+        except MissingWeightsError:
+            results.append({"building_id": item.building_id, "result": None,
+                            "error": "No weights found for the given zone and building type"})
+            continue
+        except ValueError as ve:
+            results.append({"building_id": item.building_id, "result": None, "error": str(ve)})
+            continue
+
+        results.append({"building_id": item.building_id, "result": serialize_sri_output(sri_result), "error": None})
+        updates.append({
+            "id": item.building_id,
+            "sri_scores": sri_result,
+            "total_sri": sri_result["total_sri"],
+            "levels": user_input.lev,
+        })
+    return results, updates
+
+
+@app.post("/calculate-sri/batch", response_model=List[BatchSRIResult])
+async def calculate_sri_batch(items: List[BatchSRIItem], session: AsyncSession = Depends(get_async_db)):
+    building_ids = {item.building_id for item in items}
+    existing_ids = set((await session.exec(select(Building.id).where(Building.id.in_(building_ids)))).all())
+
+    results, updates = await run_scoring(score_batch, items, existing_ids)
+
+    # Save all the results with a single executemany UPDATE
+    if updates:
+        try:
+            await session.execute(update(Building), updates)
+            await session.commit()
+        except SQLAlchemyError as e:
+            await session.rollback()
+            logging.error(f"Database error: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
-   
-@app.get("/building/{building_id}/", response_model=BuildingOutput)
-def get_curr_building(building_id: int, response: Response):
-    with get_session() as session:
-        statement = select(Building).where(Building.id == building_id)
-        building = session.exec(statement).first()
-        if not building:
-            raise HTTPException(status_code=404, detail="Building not found")
-    print(building)
-    return building
+    return ORJSONResponse(results)
 
 
-def calculate_sri_help(building_id: int, user_input: SRIInput):
+@app.put("/buildings/{building_id}/domains", response_model=BuildingOutput)
+def update_building_domains(building_id: int, response: Response, domains_data: UpdateBuildingDomains, session: Session = Depends(get_db)):
+    statement = select(Building).where(Building.id == building_id)
+    results = session.exec(statement)
+    building = results.one_or_none()
 
-    try:
-        validate_numeric_data(user_input.lev)  # Validate numeric fields
-    except ValueError as ve:
-        raise HTTPException(status_code=400, detail=str(ve))
-    try:
-        # Calculate the domain-impact criteria scores and additional metrics
-        calculated_scores = calculate_scores(user_input)
-        
-        # Ensure returned value is a dictionary
-        if not isinstance(calculated_scores, dict):
-            raise HTTPException(status_code=500, detail="Unexpected return value from calculate_scores()")
+    if not building:
+        raise HTTPException(status_code=404, detail="Building not found")
 
-        domain_impact_scores = calculated_scores.get("domain_impact_scores", {})
-        domain_max_scores = calculated_scores.get("domain_max_scores", {})
-        smart_readiness_scores = calculated_scores.get("smart_readiness_scores", {})
+    building.domains = domains_data.domains
+    session.add(building)
+    session.commit()
+    session.refresh(building)
 
-        # Calculate the weighted sums for each impact criterion
-        weighted_sums = calculate_weighted_sums(user_input, domain_impact_scores)
-        weighted_max_sums = calculate_weighted_sums(user_input, domain_max_scores)
-        
-        sr_impact_criteria = {}  # New dictionary for SR(ic) percentages
+    return ORJSONResponse(serialize_building_output(building))
 
-        # Calculate SR(ic) as (weighted_sums[ic] / weighted_max_sums[ic]) * 100
-        for ic in weighted_sums:
-            weighted_sum = weighted_sums[ic]
-            weighted_max_sum = weighted_max_sums[ic]
+@app.get("/building/{building_id}/sri_scores/", response_model=SRIOutput)
+def get_sri_scores(building_id: int, session: Session = Depends(get_db)):
+    building = session.get(Building, building_id)
+    if not building or not building.sri_scores:
+        raise HTTPException(status_code=404, detail="SRI scores not found for this building")
+    
+    return ORJSONResponse(serialize_sri_output(building.sri_scores))
 
-            if weighted_max_sum != 0:
-                sr_percentage = (weighted_sum / weighted_max_sum) * 100
-            else:
-                sr_percentage = 0  # Default to zero if division by zero risk
 
-            sr_impact_criteria[ic] = round(sr_percentage, 2)  # Round to two decimal places
+@app.get("/building/{building_id}/", response_model=BuildingOutput)
+def get_curr_building(building_id: int, response: Response, session: Session = Depends(get_db)):
+    statement = select(Building).where(Building.id == building_id)
+    building = session.exec(statement).first()
+    if not building:
+        raise HTTPException(status_code=404, detail="Building not found")
+    print(building)
+    return ORJSONResponse(serialize_building_output(building))
 
-        # Calculate SRf scores for each key functionality
-        srf_scores = calculate_srf_scores(sr_impact_criteria)
 
-        # Calculate the total SRI score
-        total_sri = calculate_total_sri(srf_scores)
+class SRIUpgradeRequest(BaseModel):
+    target_sri: float
 
-        # Calculate the weighted sums for each domain
-        #weighted_domain_sums = calculate_weighted_domain_sums(domain_impact_scores)
-        #weighted_max_domain_sums = calculate_weighted_domain_sums(domain_max_scores)
-        
-        # Calculate SR(d) for each domain
-        #sr_domains = calculate_sr_domains(weighted_domain_sums, weighted_max_domain_sums)
+@app.post("/upgrade_sri/{building_id}/")
+async def upgrade_sri(building_id: int, request: SRIUpgradeRequest, http_request: Request,
+                      session: AsyncSession = Depends(get_async_db)):
+    building = await session.get(Building, building_id)
+    if not building:
+        raise HTTPException(status_code=404, detail="Building not found")
 
+    target_sri = request.target_sri
+    current_sri = building.total_sri
+    if target_sri <= current_sri:
+        raise HTTPException(status_code=400, detail="Target SRI must be greater than the current SRI.")
 
-    except SQLAlchemyError as e:
-        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+    args = (building.building_type, building.zone, building.domains, building.levels or {}, target_sri)
+    try:
+        if planning_pool is None:
+            return await run_scoring(plan_upgrade, *args)
+        return await planning_pool.run(plan_upgrade, *args, timeout=PLANNING_TIMEOUT,
+                                       is_disconnected=http_request.is_disconnected)
+    except MissingWeightsError:
+        raise HTTPException(status_code=400, detail="No weights found for the given zone and building type")
+    except PlanningPoolFull:
+        raise HTTPException(status_code=503, detail="Too many upgrade plans in progress, please try again",
+                            headers={"Retry-After": "1"})
+    except PlanningWorkerCrashed:
+        raise HTTPException(status_code=503, detail="Upgrade planning failed, please try again",
+                            headers={"Retry-After": "1"})
+    except PlanningTimeout:
+        raise HTTPException(status_code=504, detail="Upgrade planning took too long")
+    except PlanningCancelled:
+        # The client is gone; nobody reads this response
+        raise HTTPException(status_code=499, detail="Client closed request")
+
+
+# Long-running upgrade plans and batch scoring as queued jobs: POST returns the job at once
+# (202), GET /jobs/{id} reports its status and progress and, once done, its result
+class UpgradeJobRequest(BaseModel):
+    building_id: int
+    target_sri: float
 
-    # Return all expected results
-    sri_result = {
-        "smart_readiness_scores": smart_readiness_scores,
-        "sr_impact_criteria": sr_impact_criteria,  
-        "srf_scores": srf_scores,
-        "total_sri": total_sri
-    }
-    
-    return sri_result
+class JobOutput(BaseModel):
+    id: int
+    kind: str
+    status: str
+    progress_done: int
+    progress_total: Optional[int] = None
+    error: Optional[str] = None
+    result: Optional[Any] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
 
+serialize_job_output = model_serializer(JobOutput)
 
-class SRIUpgradeRequest(BaseModel):
-    target_sri: float
 
-def get_next_level(service_code: str, current_level: int, session: Session) -> Optional[int]:
-    next_level = session.query(Levels).filter_by(code=service_code, level=current_level + 1).first()
-    return next_level.level if next_level else None
+def job_response(job: Job, status_code: int = 200):
+    return ORJSONResponse(serialize_job_output(job), status_code=status_code, headers={"Location": f"/jobs/{job.id}"})
 
-def apply_level_change(service_code: str, new_level: int, levels: dict) -> dict:
-    new_levels = {k: v.copy() for k, v in levels.items()}
-    if service_code in new_levels:
-        new_levels[service_code] = {new_level: 100}
-    return new_levels
 
-def explore_configurations(session: Session, current_config: dict, target_sri: float, 
-                           all_possible_upgrades: list, building_id: int) -> None:
-    
-    building = session.get(Building, building_id)
+@app.post("/jobs/upgrade", status_code=202, response_model=JobOutput)
+async def create_upgrade_job(request: UpgradeJobRequest, session: AsyncSession = Depends(get_async_db)):
+    building = await session.get(Building, request.building_id)
     if not building:
         raise HTTPException(status_code=404, detail="Building not found")
-    
-    for service_code, levels in current_config.items():
-        current_level = max(levels.keys(), key=int)
-        next_level = get_next_level(service_code, int(current_level), session)
-        
-        if next_level is None:
-            continue  # Skip if there's no higher level
-        
-        # Apply the change
-        new_config = apply_level_change(service_code, next_level, current_config)
-        
-        # Recalculate SRI
-        new_input = SRIInput(building_type=building.building_type,
-                             zone=building.zone, dom=building.domains, lev=new_config)
-        sri_scores = calculate_sri_help(building_id, new_input)
-        total_sri = sri_scores.get("total_sri", 0)
-        
-        if total_sri >= target_sri:
-            all_possible_upgrades.append({
-                "config": new_config,
-                "achieved_sri": total_sri
-            })
-        # Explore further changes
-        elif total_sri < target_sri:
-            explore_configurations(session, new_config, target_sri, all_possible_upgrades, building_id)
-            break
-            
-        
-def calculate_individual_sri_increase(service_code, original_level, upgraded_levels, original_sri, building, session):
-    """
-    Calculate the individual SRI increase for a specific service upgrade.
-    """
-    # Revert the service to its original level
-    temp_config = upgraded_levels.copy()
-    temp_config[service_code] = {original_level: 100}
-
-    # Recalculate SRI for the configuration with only this service not upgraded
-    new_input = SRIInput(building_type=building.building_type,
-                         zone=building.zone, dom=building.domains, lev=temp_config)
-    sri_scores = calculate_sri_help(building.id, new_input)
-    sri_with_reverted_service = sri_scores.get("total_sri", 0)
-
-    # The contribution is the difference
-    return round(original_sri - sri_with_reverted_service, 2)
+    if request.target_sri <= building.total_sri:
+        raise HTTPException(status_code=400, detail="Target SRI must be greater than the current SRI.")
 
-@app.post("/upgrade_sri/{building_id}/")
-def upgrade_sri(building_id: int, request: SRIUpgradeRequest):
-    with get_session() as session:
-        target_sri = request.target_sri
-        building = session.get(Building, building_id)
-        if not building:
-            raise HTTPException(status_code=404, detail="Building not found")
-
-        current_sri = building.total_sri
-        if target_sri <= current_sri:
-            raise HTTPException(status_code=400, detail="Target SRI must be greater than the current SRI.")
-
-        user_input = {
-            "building_type": building.building_type,
-            "zone": building.zone,
-            "dom": building.domains,
-            "lev": building.levels  # Assuming this is stored with the building
-        }
-
-        all_possible_upgrades = []
-
-        # Start exploration from the current configuration
-        explore_configurations(session, user_input['lev'], target_sri, all_possible_upgrades, building_id)
-
-        if not all_possible_upgrades:
-            return {"message": "No valid upgrades found"}
+    job = Job(kind="upgrade", payload=request.model_dump(), progress_total=1)
+    session.add(job)
+    await session.commit()
+    return job_response(job, status_code=202)
 
-        # Sort and return the best upgrade (minimal score above target)
-        best_upgrade = min(all_possible_upgrades, key=lambda x: x['achieved_sri'])
 
-        original_levels = user_input['lev']
-        upgrades = best_upgrade['config']
-        new_sri = best_upgrade['achieved_sri']
+@app.post("/jobs/batch-score", status_code=202, response_model=JobOutput)
+async def create_batch_score_job(items: List[BatchSRIItem], session: AsyncSession = Depends(get_async_db)):
+    job = Job(kind="batch-score", payload={"items": [item.model_dump() for item in items]}, progress_total=len(items))
+    session.add(job)
+    await session.commit()
+    return job_response(job, status_code=202)
 
-        # Filter services to include only those where the level has changed
-        individual_increases = {}
-        filtered_upgrades = {}
-        filtered_original_levels = {}
 
-        for service_code, original_level in original_levels.items():
-            original_level_key = max(original_level.keys(), key=int)
-            upgraded_level_key = max(upgrades.get(service_code, {}).keys(), key=int)
+@app.get("/jobs/{job_id}", response_model=JobOutput)
+async def read_job(job_id: int, session: AsyncSession = Depends(get_async_db)):
+    job = await session.get(Job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_response(job)
 
-            if original_level_key != upgraded_level_key:
-                individual_increase = calculate_individual_sri_increase(
-                    service_code, original_level_key, upgrades, new_sri, building, session)
 
-                # Only include services where the level changed
-                filtered_upgrades[service_code] = upgrades[service_code]
-                filtered_original_levels[service_code] = original_level
-                individual_increases[service_code] = individual_increase
+# Job handlers; they run in the job worker processes
+def run_upgrade_job(context: JobContext):
+    with get_session() as session:
+        building = session.get(Building, context.payload["building_id"])
+    if not building:
+        raise JobFailed("Building not found")
+    try:
+        return plan_upgrade(building.building_type, building.zone, building.domains, building.levels or {},
+                            context.payload["target_sri"], should_stop=context.should_stop)
+    except MissingWeightsError:
+        raise JobFailed("No weights found for the given zone and building type")
+
+
+# Scores the batch in chunks, saving and reporting progress after each one
+def run_batch_score_job(context: JobContext):
+    items = [BatchSRIItem.model_validate(item) for item in context.payload["items"]]
+    results = []
+    for start in range(0, len(items), JOB_CHUNK_SIZE):
+        if context.should_stop():
+            raise JobInterrupted()
+        chunk = items[start:start + JOB_CHUNK_SIZE]
+        with get_session() as session:
+            building_ids = {item.building_id for item in chunk}
+            existing_ids = set(session.exec(select(Building.id).where(Building.id.in_(building_ids))).all())
+            chunk_results, updates = score_batch(chunk, existing_ids)
+            if updates:
+                session.execute(update(Building), updates)
+                session.commit()
+        results.extend(chunk_results)
+        context.report_progress(len(results), len(items))
+    return results
 
-        response = {
-            "Upgrades": filtered_upgrades,  # Send filtered upgrades
-            "New_Score": new_sri,
-            "Original_Levels": filtered_original_levels,  # Send filtered original levels
-            "Individual_Increases": individual_increases  # Only include increases for changed services
-        }
 
-        return response
+JOB_HANDLERS["upgrade"] = run_upgrade_job
+JOB_HANDLERS["batch-score"] = run_batch_score_job
 
 
 @app.on_event("startup")
 async def startup_event():
-    reset_and_load_data()
\ No newline at end of file
+    load_reference_data(on_load=store_domain_max_scores if STORE_DOMAIN_MAX_SCORES else None)
+    refresh_catalog()
+    # Last, so forked workers inherit the loaded catalog
+    if planning_pool is not None:
+        planning_pool.start()
+    if job_workers is not None:
+        job_workers.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    scoring_executor.shutdown(wait=False, cancel_futures=True)
+    password_pool.shutdown()
+    if planning_pool is not None:
+        planning_pool.shutdown()
+    if job_workers is not None:
+        job_workers.stop()
+    await async_engine.dispose()
@@ -0,0 +1,166 @@
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
+import heapq
+import logging
+import os
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Histogram, generate_latest
+from sqlalchemy import event
+
+
+logger = logging.getLogger(__name__)
+
+# The slowest statements of a request kept for its Server-Timing header
+SLOWEST_STATEMENTS = int(os.getenv("SRI_SLOWEST_STATEMENTS", "3"))
+# Statements slower than this many seconds are logged with their request
+SLOW_STATEMENT_SECONDS = float(os.getenv("SRI_SLOW_STATEMENT_SECONDS", "0.5"))
+# The slowest statements' SQL in the Server-Timing header, for local debugging only: every client
+# sees the header, and the SQL gives away the schema. Off, the header holds only their durations.
+SERVER_TIMING_STATEMENTS = os.getenv("SRI_SERVER_TIMING_STATEMENTS", "false").lower() in ("1", "true", "yes")
+# Statement text longer than this is cut in the Server-Timing header
+STATEMENT_DESC_LENGTH = 120
+
+
+# Database work done while serving one request
+class RequestStats:
+    __slots__ = ("queries", "db_seconds", "slowest")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        # Min-heap of (seconds, statement), the SLOWEST_STATEMENTS slowest so far
+        self.slowest: List[Tuple[float, str]] = []
+
+    def record(self, seconds: float, statement: str):
+        self.queries += 1
+        self.db_seconds += seconds
+        if len(self.slowest) < SLOWEST_STATEMENTS:
+            heapq.heappush(self.slowest, (seconds, statement))
+        elif self.slowest and seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (seconds, statement))
+
+    # Slowest first
+    def slowest_statements(self) -> List[Tuple[float, str]]:
+        return sorted(self.slowest, reverse=True)
+
+
+# Set by the middleware for the duration of a request. Threadpool calls and the
+# async engine's greenlets inherit the context, so they update the same object.
+request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+registry = CollectorRegistry()
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+REQUEST_SECONDS = Histogram(
+    "sri_http_request_duration_seconds", "Time to serve a request, until the response is sent",
+    ["method", "route", "status"], registry=registry,
+)
+REQUEST_QUERIES = Histogram(
+    "sri_http_request_db_queries", "Database statements executed while serving a request",
+    ["method", "route"], buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250), registry=registry,
+)
+REQUEST_DB_SECONDS = Histogram(
+    "sri_http_request_db_seconds", "Time spent in database statements while serving a request",
+    ["method", "route"], buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+    registry=registry,
+)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    stats = request_stats.get()
+    if stats is not None:
+        stats.record(time.perf_counter() - started, statement)
+
+
+def _handle_error(exception_context):
+    # A failed statement gets no after_cursor_execute; drop its start time
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_started"):
+        connection.info["query_started"].pop()
+
+
+# Count the statements of an engine (for an AsyncEngine, pass its sync_engine) per request
+def instrument_engine(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+# One statement as a Server-Timing description: a single line, no quotes, cut to length
+def statement_description(statement: str) -> str:
+    description = " ".join(statement.split()).replace("\\", "").replace('"', "'")
+    if len(description) > STATEMENT_DESC_LENGTH:
+        description = description[:STATEMENT_DESC_LENGTH - 3] + "..."
+    return description
+
+
+def server_timing_header(stats: RequestStats, total_ms: float, statements: bool = False) -> bytes:
+    entries = [f'db;dur={stats.db_seconds * 1000:.3f};desc="{stats.queries} queries"']
+    for rank, (seconds, statement) in enumerate(stats.slowest_statements(), start=1):
+        entry = f"db-slow-{rank};dur={seconds * 1000:.3f}"
+        if statements:
+            entry += f';desc="{statement_description(statement)}"'
+        entries.append(entry)
+    entries.append(f"app;dur={total_ms:.3f}")
+    return ", ".join(entries).encode("latin-1", "replace")
+
+
+def metrics_response_body():
+    return generate_latest(registry)
+
+
+class QueryMetricsMiddleware:
+    """
+    ASGI middleware that counts the database statements and the time spent in
+    them for every HTTP request. The totals so far and the durations of the
+    slowest statements (db-slow-1, db-slow-2, ...) are sent in a
+    Server-Timing header with the response, with their SQL only when
+    SRI_SERVER_TIMING_STATEMENTS is set; statements slower than
+    SRI_SLOW_STATEMENT_SECONDS are logged.
+    The request duration, statement count and database time are recorded in
+    per-route Prometheus histograms.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                total_ms = (time.perf_counter() - started) * 1000
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"server-timing", server_timing_header(stats, total_ms, SERVER_TIMING_STATEMENTS))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_stats.reset(token)
+            route = scope.get("route")
+            route_name = route.path if route is not None else "unmatched"
+            method = scope["method"]
+            REQUEST_SECONDS.labels(method, route_name, str(status)).observe(time.perf_counter() - started)
+            REQUEST_QUERIES.labels(method, route_name).observe(stats.queries)
+            REQUEST_DB_SECONDS.labels(method, route_name).observe(stats.db_seconds)
+            for seconds, statement in stats.slowest_statements():
+                if seconds >= SLOW_STATEMENT_SECONDS:
+                    logger.warning("Slow statement (%.3f s) in %s %s: %s", seconds, method, route_name,
+                                   " ".join(statement.split()))
@@ -0,0 +1,35 @@
+from typing import Any, Optional, Tuple
+import base64
+
+import orjson
+from sqlalchemy import tuple_
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+# Opaque cursor for keyset pagination: the sort it belongs to and the last row's (sort value, id)
+def encode_cursor(sort: str, value: Any, row_id: int) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps([sort, value, row_id])).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[Any, int]:
+    try:
+        cursor_sort, value, row_id = orjson.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor")
+    if cursor_sort != sort or not isinstance(row_id, int):
+        raise InvalidCursor("The cursor belongs to another sort order")
+    return value, row_id
+
+
+# Order by (column, id) and, after a cursor, keep only the rows past it: the row-value
+# comparison lets a (column, id) index serve the page without an OFFSET scan
+def keyset_page(statement, column, id_column, descending: bool, cursor: Optional[Tuple[Any, int]]):
+    if cursor is not None:
+        key, after = tuple_(column, id_column), tuple_(*cursor)
+        statement = statement.where(key < after if descending else key > after)
+    if descending:
+        return statement.order_by(column.desc(), id_column.desc())
+    return statement.order_by(column, id_column)
@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+import asyncio
+import functools
+import threading
+import time
+
+
+# Raised when the hashing queue is full; the request should be retried later
+class HashingPoolFull(RuntimeError):
+    pass
+
+
+class PasswordHashingPool:
+    """
+    Runs password hashing and verification on a small dedicated thread pool.
+
+    Argon2 is deliberately expensive in CPU and memory, so only max_workers
+    hashes run at once and at most max_pending calls (running or queued) are
+    accepted; further calls fail fast with HashingPoolFull instead of piling
+    up behind a burst of logins. The counters describe how long calls wait
+    in the queue and how long the hashing itself takes.
+    """
+
+    def __init__(self, context, max_workers: int = 2, max_pending: int = 64):
+        self.context = context
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sri-hashing")
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(self.context.verify, password, hashed_password)
+
+    async def _run(self, func, *args):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HashingPoolFull("Too many password hashing requests queued")
+            self.pending += 1
+            self.submitted += 1
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, functools.partial(self._timed, func, time.perf_counter(), *args))
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    # Runs on a pool thread: records the queue wait and the hashing time
+    def _timed(self, func, submitted_at, *args):
+        started_at = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            finished_at = time.perf_counter()
+            wait = started_at - submitted_at
+            with self._lock:
+                self.completed += 1
+                self.wait_seconds += wait
+                self.max_wait_seconds = max(self.max_wait_seconds, wait)
+                self.run_seconds += finished_at - started_at
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "pending": self.pending,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "wait_seconds_total": self.wait_seconds,
+                "wait_seconds_max": self.max_wait_seconds,
+                "run_seconds_total": self.run_seconds,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
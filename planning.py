@@ -0,0 +1,262 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional
+import asyncio
+import gc
+import logging
+import multiprocessing
+import threading
+
+from catalog import get_catalog, refresh_catalog
+from models import engine
+from scoring import ScoreBreakdown, get_scoring_engine
+from upgrade import PlanningCancelled, UpgradePlanner, current_level
+
+
+logger = logging.getLogger(__name__)
+
+# How often a waiting request checks whether its client has gone away
+CANCEL_POLL_INTERVAL = 0.25
+
+
+# Raised when too many planning jobs are queued or running; the request should be retried later
+class PlanningPoolFull(RuntimeError):
+    pass
+
+
+# Raised when a planning job runs past its timeout
+class PlanningTimeout(TimeoutError):
+    pass
+
+
+# Raised when the workers died under a planning job twice in a row; the request should be retried later
+class PlanningWorkerCrashed(RuntimeError):
+    pass
+
+
+def calculate_individual_sri_increase(upgraded: ScoreBreakdown, service_code, original_level, upgraded_level):
+    """
+    Calculate the individual SRI increase for a specific service upgrade.
+    """
+    # Revert the service to its original level, rescoring only its domain
+    sri_with_reverted_service = get_scoring_engine().level_change_total(upgraded, service_code, upgraded_level, original_level)
+
+    # The contribution is the difference
+    return round(upgraded.total_sri - sri_with_reverted_service, 2)
+
+
+# Search the service-level combinations in memory, starting from the current configuration.
+# Raises MissingWeightsError for an unknown zone / building type, PlanningCancelled if should_stop says so.
+def plan_upgrade(building_type, zone, domains, original_levels, target_sri, should_stop=None):
+    planner = UpgradePlanner(get_scoring_engine(), building_type, zone, domains, original_levels,
+                             should_stop=should_stop)
+    best_upgrade = planner.plan(target_sri)
+
+    if best_upgrade is None:
+        return {"message": "No valid upgrades found"}
+
+    upgrades = best_upgrade.levels
+    new_sri = best_upgrade.achieved_sri
+    upgraded = get_scoring_engine().breakdown(building_type, zone, domains or [], upgrades)
+
+    # Include only the services where the level has changed
+    individual_increases = {}
+    filtered_upgrades = {}
+    filtered_original_levels = {}
+
+    for service_code, upgraded_level in best_upgrade.upgrades.items():
+        individual_increases[service_code] = calculate_individual_sri_increase(
+            upgraded, service_code, current_level(original_levels[service_code]), upgraded_level)
+        filtered_upgrades[service_code] = upgrades[service_code]
+        filtered_original_levels[service_code] = original_levels[service_code]
+
+    response = {
+        "Upgrades": filtered_upgrades,  # Send filtered upgrades
+        "New_Score": new_sri,
+        "Original_Levels": filtered_original_levels,  # Send filtered original levels
+        "Individual_Increases": individual_increases,  # Only include increases for changed services
+        # False when the search stopped at its budget: the upgrades reach the target but may not be the fewest
+        "Search_Complete": best_upgrade.complete,
+    }
+
+    return response
+
+
+# Worker process state: one cancel flag per job slot, shared with the parent process
+_cancel_flags = None
+
+
+def _init_worker(cancel_flags):
+    global _cancel_flags
+    _cancel_flags = cancel_flags
+    # Connections inherited through fork belong to the parent; never reuse them here
+    engine.dispose(close=False)
+
+
+def _warm_up(catalog_version):
+    _ensure_catalog(catalog_version)
+
+
+# Forked workers start with the parent's catalog; reload it if the reference data changed since
+def _ensure_catalog(catalog_version):
+    if get_catalog().version != catalog_version:
+        refresh_catalog()
+
+
+def _run_job(slot, catalog_version, func, args):
+    _ensure_catalog(catalog_version)
+    return func(*args, should_stop=lambda: _cancel_flags[slot] != 0)
+
+
+class PlanningPool:
+    """
+    Runs CPU-heavy planning jobs (e.g. plan_upgrade) in worker processes, so
+    long searches neither hold the GIL of the web process nor tie up its
+    threads.
+
+    With the fork start method the workers are started once the catalog and
+    scoring engine are loaded and inherit them copy-on-write (gc.freeze keeps
+    the collector from touching those pages); other start methods load them
+    from the database in each worker. At most max_pending jobs are queued or
+    running. A job that passes its timeout or whose client disconnects is
+    dropped if still queued, or told to stop through its cancel flag in
+    shared memory, which the job polls while it searches. When a worker
+    dies the pool is replaced on the next job, and the jobs it broke are
+    retried once.
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 64, start_method: Optional[str] = None):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        if start_method is None:
+            start_method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        self._mp_context = multiprocessing.get_context(start_method)
+        self._cancel_flags = self._mp_context.RawArray("b", max_pending)
+        self._free_slots = list(range(max_pending))
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.cancelled = 0
+        self.restarts = 0
+
+    # Start every worker now, from the current state of this process
+    def start(self):
+        gc.freeze()
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=self._mp_context,
+                                             initializer=_init_worker, initargs=(self._cancel_flags,))
+        version = get_catalog().version
+        for future in [self._executor.submit(_warm_up, version) for _ in range(self.max_workers)]:
+            future.result()
+
+    async def run(self, func, *args, timeout: Optional[float] = None, is_disconnected=None):
+        """
+        Run func(*args, should_stop=...) on a worker process and return its
+        result. Raises PlanningPoolFull, PlanningTimeout, PlanningCancelled
+        when is_disconnected() reports that the client went away, or
+        PlanningWorkerCrashed when the job was retried on a new pool after a
+        worker died and a worker died again.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout is not None else None
+        for attempt in range(2):
+            if self._executor is None:
+                self.start()
+            executor = self._executor
+            try:
+                return await self._run(executor, func, args, deadline, is_disconnected)
+            except BrokenProcessPool:
+                # A dead worker (OOM kill, segfault) breaks the whole pool and every job queued on it
+                self._discard(executor)
+                if attempt:
+                    raise PlanningWorkerCrashed("Planning workers crashed")
+                logger.warning("A planning worker died; retrying the job on a new pool")
+
+    async def _run(self, executor: ProcessPoolExecutor, func, args, deadline: Optional[float], is_disconnected):
+        slot, generation, cancel_flags = self._acquire_slot()
+        cancel_flags[slot] = 0
+        try:
+            job = executor.submit(_run_job, slot, get_catalog().version, func, args)
+        except BaseException:
+            self._release_slot(slot, generation)
+            raise
+        # The slot is reused only once the worker is done with it
+        job.add_done_callback(lambda _: self._release_slot(slot, generation))
+
+        loop = asyncio.get_running_loop()
+        future = asyncio.wrap_future(job)
+        try:
+            while True:
+                wait = CANCEL_POLL_INTERVAL if is_disconnected is not None else None
+                if deadline is not None:
+                    remaining = max(0.0, deadline - loop.time())
+                    wait = remaining if wait is None else min(wait, remaining)
+                done, _ = await asyncio.wait({future}, timeout=wait)
+                if done:
+                    result = future.result()
+                    with self._lock:
+                        self.completed += 1
+                    return result
+                if deadline is not None and loop.time() >= deadline:
+                    with self._lock:
+                        self.timed_out += 1
+                    raise PlanningTimeout("Planning job timed out")
+                if is_disconnected is not None and await is_disconnected():
+                    with self._lock:
+                        self.cancelled += 1
+                    raise PlanningCancelled("Client disconnected")
+        finally:
+            if not future.done():
+                cancel_flags[slot] = 1
+                future.cancel()
+
+    # Drop a broken executor; the next job starts a new one with fresh cancel flags and slots. Jobs
+    # still holding slots of the old executor release them into the old generation, not the new one.
+    def _discard(self, executor: ProcessPoolExecutor):
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+            self._generation += 1
+            self._cancel_flags = self._mp_context.RawArray("b", self.max_pending)
+            self._free_slots = list(range(self.max_pending))
+            self.restarts += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _acquire_slot(self):
+        with self._lock:
+            if not self._free_slots:
+                self.rejected += 1
+                raise PlanningPoolFull("Too many planning jobs queued")
+            self.submitted += 1
+            return self._free_slots.pop(), self._generation, self._cancel_flags
+
+    def _release_slot(self, slot: int, generation: int):
+        with self._lock:
+            if generation == self._generation:
+                self._free_slots.append(slot)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "pending": self.max_pending - len(self._free_slots),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "cancelled": self.cancelled,
+                "restarts": self.restarts,
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            # Running jobs see their flags and stop, so waiting for them is short
+            for slot in range(self.max_pending):
+                self._cancel_flags[slot] = 1
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
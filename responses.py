@@ -0,0 +1,49 @@
+from typing import Any, Callable, Dict, get_args, get_origin
+
+import orjson
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson; int dict keys are written as strings."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _float_or_none(value):
+    return float(value) if value is not None else None
+
+
+def _float_values(value):
+    return {key: float(item) for key, item in value.items()} if value is not None else None
+
+
+def _identity(value):
+    return value
+
+
+def _field_converter(annotation) -> Callable[[Any], Any]:
+    if annotation is float:
+        return _float_or_none
+    if get_origin(annotation) is dict and get_args(annotation)[1:] == (float,):
+        return _float_values
+    return _identity
+
+
+def model_serializer(model: type[BaseModel]) -> Callable[[Any], Dict[str, Any]]:
+    """
+    Build, once per response model, a function that turns a dict or an object
+    already matching the model into the plain dict response_model validation
+    would have produced: only the model's fields, in declaration order, with
+    float fields (and float-valued dicts) cast to float. Nothing is validated,
+    so it is only meant for data the app produced itself.
+    """
+    converters = tuple((name, _field_converter(field.annotation)) for name, field in model.model_fields.items())
+
+    def serialize(obj) -> Dict[str, Any]:
+        if isinstance(obj, dict):
+            return {name: convert(obj[name]) for name, convert in converters}
+        return {name: convert(getattr(obj, name)) for name, convert in converters}
+    return serialize
@@ -0,0 +1,139 @@
+from typing import Mapping, Optional, Sequence
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from cache import TTLCache
+
+
+# Content address of one SRI calculation: the scored fields of the input in a
+# canonical form, plus the reference data version they are scored against.
+# Domains keep their (deduplicated) order because it is the order of the
+# sr_domains keys; services and levels are sorted since the result does not
+# depend on their order.
+def sri_input_key(building_type: str, zone: str, domains: Sequence[str],
+                  lev: Mapping[str, Mapping[int, int]], version: Optional[str]) -> str:
+    canonical = [
+        version,
+        building_type,
+        zone,
+        list(dict.fromkeys(domains or [])),
+        sorted([code, sorted([int(level), percentage] for level, percentage in levels.items())]
+               for code, levels in lev.items()),
+    ]
+    return hashlib.sha256(json.dumps(canonical, separators=(",", ":")).encode()).hexdigest()
+
+
+class SRIResultCache:
+    """
+    Content-addressed cache of SRI results, keyed by sri_input_key.
+
+    The memory tier is an LRU of at most maxsize results. When sqlite_path
+    is set, results are also written to a SQLite file that survives
+    restarts and is shared by the workers on one host; a hit there is
+    promoted to memory. The file keeps at most disk_maxsize rows, dropping
+    the least recently used ones. Rows of reference data versions other than
+    the one being stored are dropped once nobody has used them for
+    STALE_VERSION_AGE seconds: during a rolling change the workers still on
+    the previous version keep their rows, and since the version is part of
+    the key the two never mix.
+    """
+
+    TRIM_INTERVAL = 1000
+    STALE_VERSION_AGE = 3600
+
+    def __init__(self, maxsize: int = 4096, sqlite_path: Optional[str] = None, disk_maxsize: int = 100000):
+        self.memory = TTLCache(maxsize=maxsize)
+        self.sqlite_path = sqlite_path
+        self.disk_maxsize = disk_maxsize
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        self._disk_version = None
+        self._disk_writes = 0
+        if sqlite_path:
+            self._connection = self._connect()
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.sqlite_path, check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS sri_results ("
+            "key TEXT PRIMARY KEY, version TEXT, result TEXT NOT NULL, used_at REAL NOT NULL)"
+        )
+        return connection
+
+    # SQLite connections must not cross a fork: a forked worker opens its own. The
+    # inherited one is kept, unused, since closing it could release the parent's locks.
+    def _after_fork(self):
+        self._inherited_connection = self._connection
+        self._lock = threading.Lock()
+        self._connection = self._connect()
+
+    def get(self, key: str) -> Optional[dict]:
+        result = self.memory.get(key)
+        if result is not None:
+            with self._lock:
+                self.hits += 1
+            return result
+        if self._connection is not None:
+            with self._lock:
+                row = self._connection.execute("SELECT result FROM sri_results WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._connection.execute("UPDATE sri_results SET used_at = ? WHERE key = ?", (time.time(), key))
+                    self.disk_hits += 1
+            if row is not None:
+                result = json.loads(row[0])
+                self.memory.set(key, result)
+                return result
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, result: dict, version: Optional[str] = None) -> None:
+        self.memory.set(key, result)
+        if self._connection is None:
+            return
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO sri_results (key, version, result, used_at) VALUES (?, ?, ?, ?)",
+                (key, version, json.dumps(result), time.time()),
+            )
+            # Trimming needs a full scan, so only do it on a version change and every TRIM_INTERVAL writes
+            self._disk_writes += 1
+            if version == self._disk_version and self._disk_writes % self.TRIM_INTERVAL:
+                return
+            self._disk_version = version
+            self._connection.execute(
+                "DELETE FROM sri_results WHERE version IS NOT ? AND used_at < ?",
+                (version, time.time() - self.STALE_VERSION_AGE),
+            )
+            overflow = self._connection.execute("SELECT COUNT(*) FROM sri_results").fetchone()[0] - self.disk_maxsize
+            if overflow > 0:
+                self._connection.execute(
+                    "DELETE FROM sri_results WHERE key IN (SELECT key FROM sri_results ORDER BY used_at LIMIT ?)",
+                    (overflow,),
+                )
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self._connection is not None:
+            with self._lock:
+                self._connection.execute("DELETE FROM sri_results")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "size": len(self.memory),
+                "maxsize": self.memory.maxsize,
+                "disk": self.sqlite_path is not None,
+            }
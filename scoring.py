@@ -0,0 +1,495 @@
+from dataclasses import dataclass
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+import threading
+
+import numpy as np
+from sqlalchemy import delete, insert
+from sqlmodel import select
+
+from catalog import ScoringCatalog, get_catalog
+from models import DomainMaxScore
+
+
+impact_criteria = [
+    "Energy efficiency", "Energy, flexibility and storage", "Comfort", "Convenience", "Health, wellbeing and accessibility",
+    "Maintenance and fault prediction", "Information to occupants"
+]
+
+# Mandatory services mapping as per domain
+mandatoryServices = {
+    'Heating': ['H-3', 'H-4'],
+    'Domestic hot water': ['DHW-3'],
+    'Cooling': ['C-1f', 'C-2a', 'C-3', 'C-4'],
+    'Ventilation': ['V-1a', 'V-6'],
+    'Lighting': ['L-1a', 'L-2'],
+    'Dynamic building envelope': ['DE-2'],
+    'Electricity': ['E-12'],
+    'Monitoring and control': ['MC-3', 'MC-4', 'MC-9', 'MC-13', 'MC-25', 'MC-28', 'MC-29', 'MC-30'],
+}
+
+# Adding fixed weights for the impact criteria
+impact_weights = {
+    "Energy efficiency": 0.5,
+    "Energy, flexibility and storage": 1,
+    "Comfort": 0.25,
+    "Convenience": 0.25,
+    "Health, wellbeing and accessibility": 0.25,
+    "Maintenance and fault prediction": 0.5,
+    "Information to occupants": 0.25
+}
+
+# Define the key functionalities and their associated impact criteria
+key_functionalities = {
+    "Energy Performance and Operation": ["Energy efficiency", "Maintenance and fault prediction"],
+    "Response to User Needs": ["Comfort", "Convenience", "Information to occupants", "Health, wellbeing and accessibility"],
+    "Energy Flexibility": ["Energy, flexibility and storage"]
+}
+
+N_CRITERIA = len(impact_criteria)
+
+IMPACT_WEIGHT_VECTOR = np.array([impact_weights[ic] for ic in impact_criteria], dtype=np.float64)
+
+# Criterion indices of every key functionality, padded with N_CRITERIA which
+# points at an extra zero column so each row sums in the order listed above
+_width = max(len(criteria) for criteria in key_functionalities.values())
+KEY_FUNCTIONALITY_INDEX = np.array(
+    [[impact_criteria.index(ic) for ic in criteria] + [N_CRITERIA] * (_width - len(criteria))
+     for criteria in key_functionalities.values()],
+    dtype=np.intp,
+)
+del _width
+
+
+# Column names of the seven lmax criteria in the DomainMaxScore table
+DOMAIN_MAX_FIELDS = ("lmax_cr1", "lmax_cr2", "lmax_cr3", "lmax_cr4", "lmax_cr5", "lmax_cr6", "lmax_cr7")
+
+# Distinct (domain, optional services present) lmax values kept per engine
+MAX_SCORES_CACHE_SIZE = 65536
+
+# Distinct (building type, zone, domains) dw(d, ic) matrices kept per engine; the domain list
+# comes from the request, so its orderings and subsets are bounded here
+WEIGHTS_CACHE_SIZE = 4096
+
+
+class MissingWeightsError(LookupError):
+    pass
+
+
+# l(d, ic) or lmax(d, ic) for a list of domains, one row per domain
+@dataclass(frozen=True)
+class DomainScores:
+    domains: Tuple[str, ...]
+    values: np.ndarray
+
+    def to_dict(self) -> Dict[str, float]:
+        return {
+            f"{domain}-{ic}": score
+            for domain, row in zip(self.domains, self.values.tolist())
+            for ic, score in zip(impact_criteria, row)
+        }
+
+
+# (a / b) * 100 rounded to two decimals, or 0 where b is zero
+def percentages(numerators: np.ndarray, denominators: np.ndarray) -> List[float]:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratios = (numerators / denominators) * 100
+    return [
+        round(ratio, 2) if denominator != 0 else 0
+        for ratio, denominator in zip(ratios.tolist(), denominators.tolist())
+    ]
+
+
+# SR(d, ic) keyed by "domain-criterion"
+def smart_readiness_scores(scores: DomainScores, max_scores: DomainScores) -> Dict[str, float]:
+    values = percentages(scores.values.ravel(), max_scores.values.ravel())
+    keys = (f"{domain}-{ic}" for domain in scores.domains for ic in impact_criteria)
+    return dict(zip(keys, values))
+
+
+# Sum over domains of weight(d, ic) * score(d, ic), one value per impact criterion
+def weighted_sums(weights: np.ndarray, scores: np.ndarray) -> np.ndarray:
+    return np.add.reduce(weights * scores, axis=0)
+
+
+# Sum over impact criteria of impact_weight(ic) * score(d, ic), one value per domain
+def weighted_domain_sums(scores: np.ndarray) -> np.ndarray:
+    return np.add.reduce(scores * IMPACT_WEIGHT_VECTOR, axis=1)
+
+
+# Weighted SRf score for each key functionality, rounded to two decimals
+def srf_scores(sr_impact_criteria: np.ndarray) -> Dict[str, float]:
+    weighted = np.append(IMPACT_WEIGHT_VECTOR * sr_impact_criteria, 0.0)
+    totals = np.add.reduce(weighted[KEY_FUNCTIONALITY_INDEX], axis=1)
+    return {key_func: round(total, 2) for key_func, total in zip(key_functionalities, totals.tolist())}
+
+
+def total_sri(srf: Dict[str, float]) -> float:
+    weight = 1 / 3  # Equal weight for each key functionality
+    total = 0
+    for score in srf.values():
+        total += score * weight
+    return round(total, 2)
+
+
+# Percentages are kept in a byte; int64 holds out-of-range integers and float64 anything else
+PERCENTAGE_DTYPE = np.uint8
+WIDE_PERCENTAGE_DTYPE = np.int64
+
+
+def _percentage_array(values: np.ndarray) -> np.ndarray:
+    if values.size and not np.array_equal(values, np.trunc(values)):
+        return values.astype(np.float64)
+    if values.size == 0 or (values.min() >= 0 and values.max() <= np.iinfo(PERCENTAGE_DTYPE).max):
+        return values.astype(PERCENTAGE_DTYPE)
+    return values.astype(WIDE_PERCENTAGE_DTYPE)
+
+
+@dataclass(frozen=True)
+class LevelConfiguration:
+    """
+    Compact form of SRIInput.lev / Building.levels for one ScoringEngine:
+    service codes are interned to the engine's service indices and every
+    service has one fixed-width row of percentages, indexed by level.
+    Percentages fit in a byte; the matrix widens only for values that don't.
+    """
+    percentages: np.ndarray  # services x levels
+    present: np.ndarray  # services in the configuration
+
+    # A copy with service i's row replaced (and the service marked present)
+    def with_service(self, i: int, row: np.ndarray) -> "LevelConfiguration":
+        return self.with_services([i], row[None])
+
+    # A copy with the rows of several services replaced, in one copy of the matrix
+    def with_services(self, services: Sequence[int], rows: np.ndarray) -> "LevelConfiguration":
+        percentages = self.percentages.astype(np.result_type(self.percentages, _percentage_array(rows)))
+        percentages[services] = rows
+        present = self.present
+        if not present[services].all():
+            present = present.copy()
+            present[services] = True
+        return LevelConfiguration(percentages, present)
+
+
+@dataclass(frozen=True)
+class ScoreBreakdown:
+    building_type: str
+    zone: str
+    configuration: LevelConfiguration
+    scores: DomainScores  # l(d, ic)
+    max_scores: DomainScores  # lmax(d, ic)
+    total_sri: float
+
+
+class ScoringEngine:
+    """
+    Matrix form of the SRI calculation over an immutable ScoringCatalog.
+
+    Services are laid out grouped by domain and every service has a row per
+    level (0..max level) in a dense services x levels x criteria score tensor,
+    so l(d, ic) is a per-domain sum of score * percentage over that tensor and
+    lmax(d, ic) is a product of a domain/service presence matrix with the
+    scores at each service's maximum level. Each service code is assumed to
+    belong to a single domain, which holds for the reference data.
+    """
+
+    def __init__(self, catalog: ScoringCatalog):
+        self.catalog = catalog
+
+        domains = list(catalog.levels_by_domain)
+        codes: List[str] = []
+        offsets: List[int] = []
+        for domain in domains:
+            offsets.append(len(codes))
+            for code in dict.fromkeys(entry.code for entry in catalog.levels_by_domain[domain]):
+                codes.append(code)
+        # Domains that only appear in the mandatory mapping have no services of their own
+        domains += [domain for domain in mandatoryServices if domain not in catalog.levels_by_domain]
+
+        self.domains: Tuple[str, ...] = tuple(domains)
+        self.domain_index: Dict[str, int] = {domain: i for i, domain in enumerate(domains)}
+        self.codes: Tuple[str, ...] = tuple(codes)
+        self.code_index: Dict[str, int] = {code: i for i, code in enumerate(codes)}
+        self.n_levels = max(catalog.max_level.values(), default=0) + 1
+        self.n_scored_domains = len(offsets)
+        # Range of services that belong to each scored domain
+        bounds = offsets + [len(codes)]
+        self.service_slices = [(bounds[i], bounds[i + 1]) for i in range(len(offsets))]
+
+        n_services, n_domains = len(codes), len(domains)
+        self.scores = np.zeros((n_services, self.n_levels, N_CRITERIA), dtype=np.int64)
+        self.max_scores = np.zeros((n_services, N_CRITERIA), dtype=np.int64)
+        self.membership = np.zeros((n_domains, n_services), dtype=bool)
+        self.mandatory = np.zeros((n_domains, n_services), dtype=bool)
+
+        for i, code in enumerate(codes):
+            for entry in catalog.levels_by_code[code]:
+                if catalog.level(code, entry.level) is entry:
+                    self.scores[i, entry.level] = entry.scores
+            self.max_scores[i] = catalog.level(code, catalog.max_level[code]).scores
+            self.membership[self.domain_index[catalog.levels_by_code[code][0].domain], i] = True
+        self.service_domain = self.membership.argmax(axis=0)
+        for domain, services in mandatoryServices.items():
+            for code in services:
+                if code in self.code_index:
+                    self.mandatory[self.domain_index[domain], self.code_index[code]] = True
+
+        # lmax(d, ic) is the sum of the maxima of the domain's mandatory services and of its
+        # optional services that are present. The mandatory part is precomputed per domain and
+        # the whole value memoized per pattern of optional services present.
+        self.optional = self.membership & ~self.mandatory
+        self.base_max_scores = self.mandatory.astype(np.int64) @ self.max_scores
+        self.base_max_scores.setflags(write=False)
+        self._max_scores_cache: Dict[Tuple[int, bytes], np.ndarray] = {}
+
+        self._weights_cache: Dict[Tuple[str, str, Tuple[str, ...]], np.ndarray] = {}
+
+    # Intern SRIInput.lev into a LevelConfiguration; unknown services and out-of-range levels are ignored
+    def configuration(self, lev: Mapping[str, Mapping[int, int]]) -> LevelConfiguration:
+        percentages = np.zeros((len(self.codes), self.n_levels), dtype=np.float64)
+        present = np.zeros(len(self.codes), dtype=bool)
+        for code, levels in lev.items():
+            i = self.code_index.get(code)
+            if i is None:
+                continue
+            present[i] = True
+            for level, percentage in levels.items():
+                level = int(level)
+                if 0 <= level < self.n_levels:
+                    percentages[i, level] = percentage
+        return LevelConfiguration(_percentage_array(percentages), present)
+
+    # Back to the JSON shape: every known service present, with its non-zero levels
+    def to_levels(self, configuration: LevelConfiguration) -> Dict[str, Dict[int, int]]:
+        levels = {}
+        for i in np.flatnonzero(configuration.present).tolist():
+            row = configuration.percentages[i]
+            levels[self.codes[i]] = {level: row[level].item() for level in np.flatnonzero(row).tolist()}
+        return levels
+
+    # One service's percentages row from its {level: percentage} dict
+    def _service_row(self, levels: Mapping[int, int]) -> np.ndarray:
+        row = np.zeros(self.n_levels, dtype=np.float64)
+        for level, percentage in levels.items():
+            level = int(level)
+            if 0 <= level < self.n_levels:
+                row[level] = percentage
+        return row
+
+    def _domain_rows(self, domains) -> Tuple[Tuple[str, ...], List[Optional[int]]]:
+        unique = tuple(dict.fromkeys(domains))
+        return unique, [self.domain_index.get(domain) for domain in unique]
+
+    # l(d, ic) and lmax(d, ic) for the requested domains
+    def domain_scores(self, domains, lev) -> Tuple[DomainScores, DomainScores]:
+        return self.domain_scores_from_configuration(domains, self.configuration(lev))
+
+    def domain_scores_from_configuration(self, domains,
+                                         configuration: LevelConfiguration) -> Tuple[DomainScores, DomainScores]:
+        return (self.impact_scores(domains, configuration.percentages),
+                self.max_impact_scores(domains, configuration.present))
+
+    # l(d, ic) from a services x levels percentage matrix
+    def impact_scores(self, domains, percentages: np.ndarray) -> DomainScores:
+        unique, rows = self._domain_rows(domains)
+        scores = np.zeros((len(unique), N_CRITERIA), dtype=np.float64)
+        for i, row in enumerate(rows):
+            if row is not None:
+                scores[i] = self._domain_impact_scores(row, percentages)
+        return DomainScores(unique, scores)
+
+    def _domain_impact_scores(self, row: int, percentages: np.ndarray) -> np.ndarray:
+        if row >= self.n_scored_domains:
+            return np.zeros(N_CRITERIA, dtype=np.float64)
+        start, stop = self.service_slices[row]
+        # percentage / 100 gives the same doubles the per-service dict loop used
+        weights = percentages[start:stop] / 100
+        contributions = (self.scores[start:stop] * weights[:, :, None]).reshape(-1, N_CRITERIA)
+        # A plain reduce adds the rows in order, like the original loop did
+        # (reduceat and matmul do not, which changes the last bits)
+        return np.add.reduce(contributions, axis=0)
+
+    # lmax(d, ic) from the vector of services present in the building
+    def max_impact_scores(self, domains, present: np.ndarray) -> DomainScores:
+        unique, rows = self._domain_rows(domains)
+        max_scores = np.zeros((len(unique), N_CRITERIA), dtype=np.int64)
+        for i, row in enumerate(rows):
+            if row is not None:
+                max_scores[i] = self._domain_max_scores(row, present)
+        return DomainScores(unique, max_scores)
+
+    def _domain_max_scores(self, row: int, present: np.ndarray) -> np.ndarray:
+        if row >= self.n_scored_domains:
+            return self.base_max_scores[row]
+        start, stop = self.service_slices[row]
+        optional = self.optional[row, start:stop] & present[start:stop]
+        key = (row, np.packbits(optional).tobytes())
+        max_scores = self._max_scores_cache.get(key)
+        if max_scores is None:
+            max_scores = self.base_max_scores[row] + optional.astype(np.int64) @ self.max_scores[start:stop]
+            max_scores.setflags(write=False)
+            if len(self._max_scores_cache) >= MAX_SCORES_CACHE_SIZE:
+                self._max_scores_cache.clear()
+            self._max_scores_cache[key] = max_scores
+        return max_scores
+
+    # The lmax(d, ic) contribution of every (domain, service) pair, as DomainMaxScore rows
+    def domain_max_rows(self) -> List[dict]:
+        rows = []
+        for row, domain in enumerate(self.domains):
+            for i in np.flatnonzero(self.membership[row] | self.mandatory[row]).tolist():
+                entry = {"version": self.catalog.version, "domain": domain, "code": self.codes[i],
+                         "mandatory": bool(self.mandatory[row, i])}
+                entry.update(zip(DOMAIN_MAX_FIELDS, self.max_scores[i].tolist()))
+                rows.append(entry)
+        return rows
+
+    # Scores of one configuration kept for cheap rescoring of single-service changes
+    def breakdown(self, building_type: str, zone: str, domains, lev) -> "ScoreBreakdown":
+        return self.breakdown_from_configuration(building_type, zone, domains, self.configuration(lev))
+
+    def breakdown_from_configuration(self, building_type: str, zone: str, domains,
+                                     configuration: LevelConfiguration) -> "ScoreBreakdown":
+        domains = tuple(dict.fromkeys(domains))
+        scores = self.impact_scores(domains, configuration.percentages)
+        max_scores = self.max_impact_scores(domains, configuration.present)
+        return ScoreBreakdown(building_type, zone, configuration, scores, max_scores,
+                              self.total_sri(building_type, zone, scores, max_scores))
+
+    # A copy of configuration with every given service moved wholly (100%) to its new level
+    def upgraded_configuration(self, configuration: LevelConfiguration,
+                               upgrades: Mapping[str, int]) -> LevelConfiguration:
+        rows = np.zeros((len(upgrades), self.n_levels), dtype=PERCENTAGE_DTYPE)
+        rows[np.arange(len(upgrades)), list(upgrades.values())] = 100
+        return configuration.with_services([self.code_index[code] for code in upgrades], rows)
+
+    # Replace one service's levels and rescore only the domain row it belongs to
+    def with_service_levels(self, breakdown: "ScoreBreakdown", service_code: str,
+                            levels: Mapping[int, int]) -> "ScoreBreakdown":
+        i = self.code_index[service_code]
+        configuration = breakdown.configuration.with_service(i, self._service_row(levels))
+        return self._rescore_service(breakdown, i, configuration)
+
+    # Move the percentage a service has at old_level to new_level. The service must be configured
+    # with a percentage at old_level: adding a service would also change lmax(d, ic).
+    def with_level_change(self, breakdown: "ScoreBreakdown", service_code: str,
+                          old_level: int, new_level: int) -> "ScoreBreakdown":
+        i = self.code_index[service_code]
+        if not (0 <= old_level < self.n_levels and 0 <= new_level < self.n_levels):
+            raise ValueError(f"Invalid level change for {service_code}: {old_level} -> {new_level}")
+        if not breakdown.configuration.present[i] or breakdown.configuration.percentages[i, old_level] == 0:
+            raise ValueError(f"{service_code} has nothing at level {old_level} to move")
+        if old_level == new_level:
+            return breakdown
+        row = breakdown.configuration.percentages[i].astype(np.result_type(WIDE_PERCENTAGE_DTYPE,
+                                                                          breakdown.configuration.percentages))
+        row[new_level] += row[old_level]
+        row[old_level] = 0
+        return self._rescore_service(breakdown, i, breakdown.configuration.with_service(i, row))
+
+    # New total SRI after a single (service_code, old_level -> new_level) change
+    def level_change_total(self, breakdown: "ScoreBreakdown", service_code: str,
+                           old_level: int, new_level: int) -> float:
+        return self.with_level_change(breakdown, service_code, old_level, new_level).total_sri
+
+    def _rescore_service(self, breakdown: "ScoreBreakdown", i: int,
+                         configuration: LevelConfiguration) -> "ScoreBreakdown":
+        scores, max_scores = breakdown.scores, breakdown.max_scores
+        row = self.service_domain[i]
+        domain = self.domains[row]
+        if domain in scores.domains:
+            position = scores.domains.index(domain)
+            values = scores.values.copy()
+            values[position] = self._domain_impact_scores(row, configuration.percentages)
+            scores = DomainScores(scores.domains, values)
+            if not breakdown.configuration.present[i]:
+                # A service that was not configured before also raises lmax(d, ic)
+                max_values = max_scores.values.copy()
+                max_values[position] = self._domain_max_scores(row, configuration.present)
+                max_scores = DomainScores(max_scores.domains, max_values)
+        return ScoreBreakdown(breakdown.building_type, breakdown.zone, configuration, scores, max_scores,
+                              self.total_sri(breakdown.building_type, breakdown.zone, scores, max_scores))
+
+    # dw(d, ic) for the building type and zone, one row per domain
+    def domain_weights(self, building_type: str, zone: str, domains: Tuple[str, ...]) -> np.ndarray:
+        key = (building_type, zone, domains)
+        weights = self._weights_cache.get(key)
+        if weights is None:
+            rows = []
+            for domain in domains:
+                row = self.catalog.domain_weight(building_type, zone, domain)
+                if not row:
+                    raise MissingWeightsError(domain)
+                rows.append(row)
+            weights = np.array(rows, dtype=np.float64).reshape(len(domains), N_CRITERIA)
+            weights.setflags(write=False)
+            if len(self._weights_cache) >= WEIGHTS_CACHE_SIZE:
+                self._weights_cache.clear()
+            self._weights_cache[key] = weights
+        return weights
+
+    # SR(ic) for each impact criterion, in impact_criteria order
+    def sr_impact_criteria(self, building_type: str, zone: str, scores: DomainScores,
+                           max_scores: DomainScores) -> List[float]:
+        weights = self.domain_weights(building_type, zone, scores.domains)
+        return percentages(weighted_sums(weights, scores.values), weighted_sums(weights, max_scores.values))
+
+    # Only the total SRI, for callers that score many candidate configurations
+    def total_sri(self, building_type: str, zone: str, scores: DomainScores, max_scores: DomainScores) -> float:
+        sr_impact = self.sr_impact_criteria(building_type, zone, scores, max_scores)
+        return total_sri(srf_scores(np.array(sr_impact, dtype=np.float64)))
+
+    # The whole SRIOutput for one configuration
+    def evaluate(self, building_type: str, zone: str, domains, lev, include_domains: bool = True) -> dict:
+        scores, max_scores = self.domain_scores(domains, lev)
+        return self.evaluate_scores(building_type, zone, scores, max_scores, include_domains)
+
+    def evaluate_scores(self, building_type: str, zone: str, scores: DomainScores,
+                        max_scores: DomainScores, include_domains: bool = True) -> dict:
+        sr_impact = self.sr_impact_criteria(building_type, zone, scores, max_scores)
+        srf = srf_scores(np.array(sr_impact, dtype=np.float64))
+        result = {
+            "smart_readiness_scores": smart_readiness_scores(scores, max_scores),
+            "sr_impact_criteria": dict(zip(impact_criteria, sr_impact)),
+        }
+        if include_domains:
+            sr_domains = percentages(weighted_domain_sums(scores.values), weighted_domain_sums(max_scores.values))
+            result["sr_domains"] = dict(zip(scores.domains, sr_domains))
+        result["srf_scores"] = srf
+        result["total_sri"] = total_sri(srf)
+        return result
+
+
+_scoring_engine: Optional[ScoringEngine] = None
+_scoring_engine_lock = threading.Lock()
+
+
+# Return the engine for the current catalog, rebuilding it when the catalog is refreshed
+def get_scoring_engine(session=None) -> ScoringEngine:
+    global _scoring_engine
+    catalog = get_catalog(session)
+    scoring_engine = _scoring_engine
+    if scoring_engine is None or scoring_engine.catalog is not catalog:
+        with _scoring_engine_lock:
+            scoring_engine = _scoring_engine
+            if scoring_engine is None or scoring_engine.catalog is not catalog:
+                scoring_engine = ScoringEngine(catalog)
+                _scoring_engine = scoring_engine
+    return scoring_engine
+
+
+def store_domain_max_scores(session, version: str) -> bool:
+    """
+    Replace the DomainMaxScore rows with the ones derived from the reference
+    tables as the session sees them, unless they were already derived from
+    this version. Meant as load_reference_data's on_load hook, so the rows
+    change in the same transaction as the data they come from. Returns
+    whether the table was rewritten; the caller commits.
+    """
+    stored = session.exec(select(DomainMaxScore.version).limit(1)).first()
+    if stored == version:
+        return False
+    session.execute(delete(DomainMaxScore))
+    rows = ScoringEngine(ScoringCatalog.from_session(session)).domain_max_rows()
+    if rows:
+        session.execute(insert(DomainMaxScore), rows)
+    return True
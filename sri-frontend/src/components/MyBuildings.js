@@ -5,27 +5,34 @@ import { useNavigate } from "react-router-dom";
 import { Icon } from "semantic-ui-react";
 import './styling/Mybuilding.css'; // Import the CSS file
 
+// Only the columns the table shows, a page at a time
+const BUILDING_FIELDS = "building_name,building_type,building_usage,building_state,energy_class,zone,country,city,region,street,zip,year";
+const PAGE_SIZE = 100;
+
 const MyBuildings = () => {
   const [buildings, setBuildings] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [userInfo, setUserInfo] = useState({});
   const [showUserInfo, setShowUserInfo] = useState(false); // State to control user info popup
   const navigate = useNavigate();
 
-  useEffect(() => {
-    const fetchBuildings = async () => {
-      try {
-        const token = localStorage.getItem("token");
-        const response = await axios.get("http://localhost:8000/my_buildings/", {
-          headers: {
-            Authorization: `Bearer ${token}`,
-          },
-        });
-        setBuildings(response.data);
-      } catch (error) {
-        console.error("Error fetching buildings", error);
-      }
-    };
+  const fetchBuildings = async (cursor) => {
+    try {
+      const token = localStorage.getItem("token");
+      const response = await axios.get("http://localhost:8000/my_buildings/", {
+        headers: {
+          Authorization: `Bearer ${token}`,
+        },
+        params: { fields: BUILDING_FIELDS, limit: PAGE_SIZE, ...(cursor && { cursor }) },
+      });
+      setBuildings((previous) => (cursor ? [...previous, ...response.data] : response.data));
+      setNextCursor(response.headers["x-next-cursor"] || null);
+    } catch (error) {
+      console.error("Error fetching buildings", error);
+    }
+  };
 
+  useEffect(() => {
     const fetchUserInfo = async () => {
       try {
         const token = localStorage.getItem("token");
@@ -138,6 +145,9 @@ const MyBuildings = () => {
                 ))}
               </Table.Body>
             </Table>
+            {nextCursor && (
+              <Button className="view-sri-button" onClick={() => fetchBuildings(nextCursor)}>Load more</Button>
+            )}
           </Container>
         </div>
       </div>
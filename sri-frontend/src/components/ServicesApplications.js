@@ -6,6 +6,20 @@ import { Icon } from "semantic-ui-react";
 
 import './styling/Mybuilding.css'; // Import the CSS file
 
+// All domains, services and levels come from one cached /catalog request
+let catalogRequest = null;
+const fetchCatalog = () => {
+    if (!catalogRequest) {
+        catalogRequest = axios.get('http://localhost:8000/catalog')
+            .then(response => response.data)
+            .catch(error => {
+                catalogRequest = null;
+                throw error;
+            });
+    }
+    return catalogRequest;
+};
+
 // Example function to get icon based on domain
 const getIconForDomain = (domain) => {
     switch (domain) {
@@ -83,8 +97,8 @@ const ServicesApplications = () => {
     useEffect(() => {
         const fetchServices = async (domain) => {
             try {
-                const response = await axios.get(`http://localhost:8000/services/${domain}`);
-                const serviceData = response.data;
+                const catalog = await fetchCatalog();
+                const serviceData = catalog.domains[domain] || [];
 
                 const filteredServiceData = serviceData.filter(service => !/User defined smart ready service \(\d+\)/.test(service.service_desc));
                 setServices(filteredServiceData);
@@ -126,9 +140,10 @@ const ServicesApplications = () => {
             };
 
             if (!currentServiceSelection.levels.length && !currentServiceSelection.active) {
-                axios.get(`http://localhost:8000/levels/${service.code}`)
-                    .then(response => {
-                        const levelData = response.data.map(level => ({
+                fetchCatalog()
+                    .then(catalog => {
+                        const catalogService = (catalog.domains[activeDomain] || []).find(entry => entry.code === service.code);
+                        const levelData = (catalogService ? catalogService.levels : []).map(level => ({
                             desc: level.level_desc + ": " + level.description,
                             intLevel: level.level
                         }));
@@ -0,0 +1,188 @@
+from contextlib import nullcontext
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Optional
+import cProfile
+import logging
+import os
+import random
+import re
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class Tracer:
+    """
+    Named timing spans around the stages of a calculation. The base class is
+    the no-op default: span() hands back one shared null context, so the
+    instrumented code costs next to nothing when tracing is off.
+    """
+
+    _null_span = nullcontext()
+
+    def span(self, name: str, **attributes):
+        return self._null_span
+
+
+# Spans through the OpenTelemetry API; they go wherever the configured SDK exports them
+class OpenTelemetryTracer(Tracer):
+    def __init__(self, instrumentation_name: str = "sri_calculator"):
+        from opentelemetry import trace
+        self._tracer = trace.get_tracer(instrumentation_name)
+
+    def span(self, name: str, **attributes):
+        return self._tracer.start_as_current_span(name, attributes=attributes or None)
+
+
+# Logs every span's duration at DEBUG level; handy without an OpenTelemetry collector
+class LoggingTracer(Tracer):
+    def span(self, name: str, **attributes):
+        return _LoggedSpan(name, attributes)
+
+
+class _LoggedSpan:
+    __slots__ = ("name", "attributes", "started")
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        logger.debug("span %s took %.3f ms %s", self.name, (time.perf_counter() - self.started) * 1000,
+                     self.attributes or "")
+        return False
+
+
+TRACERS = {"none": Tracer, "otel": OpenTelemetryTracer, "log": LoggingTracer}
+
+
+# The tracer named by SRI_TRACER; an unknown name or a missing OpenTelemetry API falls back
+# to the no-op tracer with a warning rather than keeping the app from starting
+def make_tracer(name: str) -> Tracer:
+    tracer_class = TRACERS.get(name.strip().lower())
+    if tracer_class is None:
+        logger.warning("Unknown SRI_TRACER %r, use one of: %s; tracing is off", name, ", ".join(TRACERS))
+        return Tracer()
+    try:
+        return tracer_class()
+    except ImportError as e:
+        logger.warning("SRI_TRACER=%s needs a missing package (%s); tracing is off", name, e)
+        return Tracer()
+
+
+_tracer: Tracer = make_tracer(os.getenv("SRI_TRACER", "none"))
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def set_tracer(tracer: Tracer) -> None:
+    global _tracer
+    _tracer = tracer
+
+
+# Per-request profiling, requested with the X-SRI-Profile header (cprofile or pyinstrument)
+# when SRI_PROFILING is on, or picked for a random SRI_PROFILE_SAMPLE_RATE share of requests
+PROFILE_HEADER = b"x-sri-profile"
+PROFILE_OUTPUT_HEADER = b"x-sri-profile-output"
+PROFILE_MODES = ("cprofile", "pyinstrument")
+PROFILING_ENABLED = os.getenv("SRI_PROFILING", "false").lower() in ("1", "true", "yes")
+PROFILE_SAMPLE_RATE = float(os.getenv("SRI_PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("SRI_PROFILE_DIR", "profiles")
+
+
+class ProfileRequest:
+    __slots__ = ("mode", "name", "outputs")
+
+    def __init__(self, mode: str, name: str):
+        self.mode = mode
+        self.name = name
+        self.outputs = []
+
+
+profile_request: ContextVar[Optional[ProfileRequest]] = ContextVar("profile_request", default=None)
+
+
+# Run func under the profiler the current request asked for, if any. Profilers only
+# see their own thread, so this wraps the work where it runs (e.g. on the scoring pool).
+def profiled(func, *args, **kwargs):
+    request = profile_request.get()
+    if request is None:
+        return func(*args, **kwargs)
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stem = os.path.join(PROFILE_DIR, f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}-{request.name}")
+    if request.mode == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logger.warning("pyinstrument is not installed; profiling with cProfile instead")
+        else:
+            profiler = Profiler(async_mode="disabled")
+            profiler.start()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.stop()
+                path = stem + ".html"
+                with open(path, "w") as f:
+                    f.write(profiler.output_html())
+                request.outputs.append(os.path.basename(path))
+                logger.info("Profile written to %s", path)
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        path = stem + ".prof"
+        profiler.dump_stats(path)
+        request.outputs.append(os.path.basename(path))
+        logger.info("Profile written to %s", path)
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that turns on profiling for a request (see profiled) and
+    returns the names of the written profile files, in SRI_PROFILE_DIR, in
+    the X-SRI-Profile-Output header; the server's paths are only logged.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        mode = self._mode(scope) if scope["type"] == "http" else None
+        if mode is None:
+            await self.app(scope, receive, send)
+            return
+
+        request = ProfileRequest(mode, re.sub(r"[^A-Za-z0-9]+", "_", scope["path"]).strip("_") or "root")
+        token = profile_request.set(request)
+
+        async def send_with_output(message):
+            if message["type"] == "http.response.start" and request.outputs:
+                message["headers"] = list(message.get("headers", [])) + [
+                    (PROFILE_OUTPUT_HEADER, ", ".join(request.outputs).encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_output)
+        finally:
+            profile_request.reset(token)
+
+    def _mode(self, scope) -> Optional[str]:
+        if PROFILING_ENABLED:
+            for name, value in scope["headers"]:
+                if name == PROFILE_HEADER:
+                    mode = value.decode().lower()
+                    return mode if mode in PROFILE_MODES else None
+        if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            return "cprofile"
+        return None
@@ -0,0 +1,237 @@
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+from scoring import LevelConfiguration, ScoringEngine
+
+
+# Largest drift of one total SRI from its unrounded value: the total, the SRf
+# scores and the SR(ic) percentages are each rounded to two decimals
+ROUNDING_SLACK = 0.015
+
+# Above this many moves one full rescoring is cheaper than applying the moves as deltas
+MAX_DELTA_MOVES = 3
+
+# Search nodes visited between two checks of should_stop
+STOP_CHECK_INTERVAL = 1024
+
+
+# Raised out of a search that was told to stop (timeout, client gone)
+class PlanningCancelled(Exception):
+    pass
+
+
+# Moving one service to a higher level, and the SRI gained by that move alone
+@dataclass(frozen=True)
+class UpgradeOption:
+    service_code: str
+    level: int
+    steps: int
+    gain: float
+
+
+@dataclass(frozen=True)
+class UpgradePlan:
+    upgrades: Dict[str, int]  # service code -> new level
+    levels: Dict[str, Dict[int, int]]  # the whole configuration after the upgrades (known services only)
+    achieved_sri: float
+    # False when the search ran out of budget: the plan reaches the target but may not be the smallest
+    complete: bool = True
+
+
+# The level a service is at: the highest level it has a percentage for
+def current_level(service_levels: Mapping) -> Optional[int]:
+    return max((int(level) for level in service_levels), default=None)
+
+
+class UpgradePlanner:
+    """
+    Branch-and-bound search for the smallest set of service upgrades that
+    lifts a building to a target SRI, scored in memory with a ScoringEngine.
+
+    Every (service, higher level) move is scored once on its own, as a delta
+    on the cached ScoreBreakdown of the current configuration. The total
+    SRI is linear in the level scores apart from the two-decimal rounding of
+    its intermediate percentages, so the sum of the single-move gains is a
+    tight estimate of a combination's total. The search walks combinations of
+    k services for k = 1, 2, ... using that estimate as a bound and scores
+    only the promising ones exactly. For the first k that reaches the target
+    it returns the combination with the lowest total SRI at or above it,
+    preferring fewer level steps on ties. should_stop, if given, is polled
+    during the search; once it returns True the search raises
+    PlanningCancelled.
+
+    A greedy plan (the best single moves, largest gain first, trimmed of the
+    moves it can do without) is built up front. If the search runs out of
+    max_evaluations or max_nodes before proving a smaller plan, the best
+    plan found so far is returned with complete=False, so a reachable
+    target is never reported as unreachable. None means that even every
+    service at its best level falls short of the target.
+    """
+
+    def __init__(self, scoring_engine: ScoringEngine, building_type: str, zone: str,
+                 domains, levels: Mapping[str, Mapping], max_evaluations: int = 5000,
+                 max_nodes: int = 200000, should_stop: Optional[Callable[[], bool]] = None):
+        self.scoring_engine = scoring_engine
+        self.building_type = building_type
+        self.zone = zone
+        self.domains = tuple(dict.fromkeys(domains or []))
+        self.levels = levels
+        self.max_evaluations = max_evaluations
+        self.max_nodes = max_nodes
+        self.should_stop = should_stop
+        self.evaluations = 0
+        self.nodes = 0
+        self.ceiling_sri = None  # total SRI with every service at its best level, set by plan
+
+        self.base = scoring_engine.breakdown(building_type, zone, self.domains, levels)
+        self.base_sri = self.base.total_sri
+
+    # Exact total SRI of the base configuration with the given moves applied,
+    # rescoring only the domain rows the moves touch (the whole building for many moves)
+    def score(self, moves) -> float:
+        self._check_stop()
+        self.evaluations += 1
+        if len(moves) > MAX_DELTA_MOVES:
+            return self.scoring_engine.breakdown_from_configuration(
+                self.building_type, self.zone, self.domains, self.configuration(moves)).total_sri
+        breakdown = self.base
+        for option in moves:
+            breakdown = self.scoring_engine.with_service_levels(breakdown, option.service_code, {option.level: 100})
+        return breakdown.total_sri
+
+    # The base configuration with the given moves applied
+    def configuration(self, moves) -> LevelConfiguration:
+        upgrades = {option.service_code: option.level for option in moves}
+        return self.scoring_engine.upgraded_configuration(self.base.configuration, upgrades)
+
+    def _check_stop(self):
+        if self.should_stop is not None and self.should_stop():
+            raise PlanningCancelled("Upgrade planning was stopped")
+
+    # Candidate moves per service, best first; services that cannot gain anything are left out
+    def options(self) -> List[List[UpgradeOption]]:
+        catalog = self.scoring_engine.catalog
+        services = []
+        for code, service_levels in self.levels.items():
+            level = current_level(service_levels)
+            if code not in self.scoring_engine.code_index or level is None:
+                continue
+            service_options = []
+            for entry in catalog.levels_by_code[code]:
+                if entry.level > level and catalog.level(code, entry.level) is entry:
+                    option = UpgradeOption(code, entry.level, entry.level - level, 0.0)
+                    gain = self.score((option,)) - self.base_sri
+                    if gain > 0:
+                        service_options.append(UpgradeOption(code, entry.level, entry.level - level, gain))
+            if service_options:
+                service_options.sort(key=lambda option: (-option.gain, option.steps))
+                services.append(service_options)
+        services.sort(key=lambda service_options: -service_options[0].gain)
+        return services
+
+    def plan(self, target_sri: float) -> Optional[UpgradePlan]:
+        services = self.options()
+        best_gains = [service_options[0].gain for service_options in services]
+        needed = target_sri - self.base_sri
+        greedy = self._greedy(services, target_sri)
+        if greedy is None and self.ceiling_sri + 2 * ROUNDING_SLACK < target_sri:
+            return None  # out of reach, by more than rounding could make up for
+
+        for k in range(1, len(services) + 1):
+            slack = ROUNDING_SLACK * (2 * k + 2)
+            if sum(best_gains[:k]) + slack < needed:
+                continue
+            # The greedy plan is the one to beat once the search reaches its size
+            incumbent = greedy if greedy is not None and len(greedy[2]) == k else None
+            best = self._search(services, best_gains, k, target_sri, slack, incumbent)
+            exhausted = self.evaluations >= self.max_evaluations or self.nodes >= self.max_nodes
+            if best is not None:
+                return self._upgrade_plan(best, complete=not exhausted)
+            if exhausted:
+                break
+        if greedy is not None:
+            return self._upgrade_plan(greedy, complete=False)
+        return None
+
+    def _upgrade_plan(self, best: Tuple[float, int, Tuple[UpgradeOption, ...]], complete: bool) -> UpgradePlan:
+        achieved_sri, _, moves = best
+        upgrades = {option.service_code: option.level for option in moves}
+        return UpgradePlan(upgrades=upgrades, levels=self.scoring_engine.to_levels(self.configuration(moves)),
+                           achieved_sri=achieved_sri, complete=complete)
+
+    # A plan that reaches the target without searching, as (achieved SRI, level steps, moves), or None
+    # if even the best move of every service falls short: the shortest prefix of the best moves,
+    # largest gain first, that reaches the target, less the moves it still reaches it without
+    def _greedy(self, services: List[List[UpgradeOption]],
+                target_sri: float) -> Optional[Tuple[float, int, Tuple[UpgradeOption, ...]]]:
+        best_moves = [service_options[0] for service_options in services]
+        self.ceiling_sri = self.score(best_moves) if best_moves else self.base_sri
+        if self.ceiling_sri < target_sri:
+            return None
+        # The achieved SRI grows with the prefix, up to rounding; bisect on it
+        low, high = 1, len(best_moves)
+        while low < high:
+            middle = (low + high) // 2
+            if self.score(best_moves[:middle]) >= target_sri:
+                high = middle
+            else:
+                low = middle + 1
+        moves = best_moves[:high]
+        achieved_sri = self.score(moves)
+        if achieved_sri < target_sri:
+            moves, achieved_sri = best_moves, self.ceiling_sri
+        for option in sorted(moves, key=lambda option: option.gain):
+            fewer = [move for move in moves if move is not option]
+            fewer_sri = self.score(fewer) if fewer else self.base_sri
+            if fewer_sri >= target_sri:
+                moves, achieved_sri = fewer, fewer_sri
+        return achieved_sri, sum(option.steps for option in moves), tuple(moves)
+
+    # Best combination of exactly k services, as (achieved SRI, level steps, moves)
+    def _search(self, services: List[List[UpgradeOption]], best_gains: List[float], k: int,
+                target_sri: float, slack: float, best: Optional[Tuple[float, int, Tuple[UpgradeOption, ...]]] = None
+                ) -> Optional[Tuple[float, int, Tuple[UpgradeOption, ...]]]:
+        needed = target_sri - self.base_sri
+        # prefix[i] is the sum of the i largest single-move gains, used for the optimistic bound
+        prefix = np.concatenate(([0.0], np.cumsum(best_gains))).tolist()
+
+        # Explicit stack of (next service position, chosen moves, estimated gain)
+        stack = [(0, (), 0.0)]
+        while stack:
+            if self.evaluations >= self.max_evaluations or self.nodes >= self.max_nodes:
+                break
+            start, moves, estimate = stack.pop()
+            self.nodes += 1
+            if self.nodes % STOP_CHECK_INTERVAL == 0:
+                self._check_stop()
+            remaining = k - len(moves)
+
+            if remaining == 0:
+                if estimate + slack < needed:
+                    continue
+                if best is not None and self.base_sri + estimate - slack > best[0]:
+                    continue
+                achieved_sri = self.score(moves)
+                steps = sum(option.steps for option in moves)
+                if achieved_sri >= target_sri and (best is None or (achieved_sri, steps) < best[:2]):
+                    best = (achieved_sri, steps, moves)
+                continue
+
+            # Push in reverse so the most promising branch is explored first
+            children = []
+            for position in range(start, len(services) - remaining + 1):
+                # The best the rest can add is the next largest gains after this service
+                optimistic = prefix[position + remaining] - prefix[position]
+                if estimate + optimistic + slack < needed:
+                    break
+                for option in services[position]:
+                    child_estimate = estimate + option.gain
+                    if best is not None and self.base_sri + child_estimate - slack > best[0]:
+                        continue
+                    children.append((position + 1, moves + (option,), child_estimate))
+            stack.extend(reversed(children))
+
+        return best
+